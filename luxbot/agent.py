@@ -1,23 +1,25 @@
 import logging
 import math
 import sys
+import time
 from enum import Enum
 import itertools
-from functools import lru_cache
 from typing import Dict, List
 
 import numpy
 
 from lux.game import Game
-from lux.game_map import Cell, RESOURCE_TYPES, Astar
+from lux.game_map import Cell, RESOURCE_TYPES, RESOURCE_TYPE_IDS, Astar, FlowFields, DistanceFields, adjacent_mask, cross_sum
 from lux.game_objects import Unit, City, CityTile, Position
 from lux.constants import Constants
 from lux.game_constants import GAME_CONSTANTS
 from lux import annotate
-from tools import Log, LogEntry
+from tools import UnitStore, TurnProfiler
 
 DIRECTIONS = Constants.DIRECTIONS()
-global game, myagent, log
+DEFAULT_ACT_TIMEOUT = 3
+MASS_EXPIRY_CITYTILES = 5
+FRUSTRATED_TURNS = 3  # Turns held short of a target before a unit counts as frustrated, in profiler counters
 
 
 class Task(Enum):
@@ -73,10 +75,6 @@ def get_command_from_action(unit, action):
         return unit.transfer(...)  # TODO
 
 
-def pos2cell(pos: Position) -> Cell:
-    return game.map.get_cell_by_pos(pos)
-
-
 def group_units_by_requested_cells(units2cells: Dict[Unit, List[Cell]]):
     cell2units: Dict[Cell, List[Unit]] = {}
     for u, c in units2cells.items():
@@ -87,12 +85,117 @@ def group_units_by_requested_cells(units2cells: Dict[Unit, List[Cell]]):
     return cell2units
 
 
+def assign_with_capacities(cost: numpy.ndarray, capacity: List[int]) -> List[int]:
+    """Assign rows to columns at least total cost, each column taking at most capacity[j] rows.
+    Infeasible pairs have infinite cost. As many rows as possible are assigned, by successive shortest augmenting
+    paths: each step brings one free row in, possibly moving assigned rows between columns to make room.
+    Returns the column of each row, -1 if it could not be assigned."""
+    n_rows, n_cols = cost.shape
+    rows, cols = numpy.arange(n_rows), numpy.arange(n_cols)
+    assigned = numpy.full(n_rows, -1)
+    spare = numpy.array(capacity, dtype=int)
+    while (assigned == -1).any() and (spare > 0).any():
+        free_rows, moved_rows = rows[assigned == -1], rows[assigned != -1]
+        # Cheapest free row into each column
+        best = cost[free_rows].argmin(axis=0)
+        dist = cost[free_rows[best], cols]
+        parent = free_rows[best]  # Row entering each column on its shortest path
+        if len(moved_rows) > 0:
+            # Bellman-Ford over columns: reach j by moving a row out of the column it is assigned to
+            moved_from = assigned[moved_rows]
+            move_cost = cost[moved_rows] - cost[moved_rows, moved_from][:, None]
+            for _ in range(n_cols):
+                candidate = dist[moved_from][:, None] + move_cost
+                best = candidate.argmin(axis=0)
+                improved = candidate[best, cols] < dist
+                if not improved.any():
+                    break
+                dist = numpy.where(improved, candidate[best, cols], dist)
+                parent = numpy.where(improved, moved_rows[best], parent)
+        dist = numpy.where(spare > 0, dist, math.inf)
+        col = int(dist.argmin())
+        if dist[col] == math.inf:
+            break
+        spare[col] -= 1
+        while True:  # Walk the path back, moving each row along until the free row is placed
+            row = parent[col]
+            col, assigned[row] = assigned[row], col
+            if col == -1:
+                break
+    return assigned.tolist()
+
+
+class SearchBudget:
+    """Hands out A* searches for a turn against the turn's time limit.
+    The search depth shrinks as unit count grows. Once SOFT_FRACTION of the time is used, units that are not a search
+    priority move greedily towards their target; after HARD_FRACTION every unit does."""
+    SOFT_FRACTION = 0.5
+    HARD_FRACTION = 0.8
+
+    def __init__(self, turn_start, time_limit, unit_count):
+        self.turn_start = turn_start
+        self.time_limit = time_limit  # Seconds, None for no limit
+        if unit_count < 40:
+            self.limit = 8
+        elif unit_count < 50:
+            self.limit = 4
+        else:
+            self.limit = 2
+        self.greedy_moves = 0
+
+    def can_search(self, priority: bool) -> bool:
+        if self.time_limit is None:
+            return True
+        used = (time.perf_counter() - self.turn_start) / self.time_limit
+        if used < self.SOFT_FRACTION or (priority and used < self.HARD_FRACTION):
+            return True
+        self.greedy_moves += 1
+        return False
+
+
+class TimeBank:
+    """Lux overage time: a bank shared by the whole match for turns that run past actTimeout.
+    Spent only on critical turns, a share at a time, and never below SAFETY_FLOOR seconds.
+    The bank is read from obs.remainingOverageTime, or estimated from recorded turn times when that is missing."""
+    INITIAL = 60
+    SAFETY_FLOOR = 15
+    CRITICAL_TURN_SHARE = 0.1
+
+    def __init__(self, act_timeout):
+        self.act_timeout = act_timeout  # None for no limit
+        self.remaining = self.INITIAL
+        self.extra_time = 0  # Overage the current turn may use
+        self.turn_times: List[float] = []
+
+    def start_turn(self, obs, critical: bool) -> float:
+        """Overage granted to this turn, in seconds."""
+        reported = getattr(obs, 'remainingOverageTime', None)
+        if reported is not None:
+            self.remaining = reported
+        spendable = self.remaining - self.SAFETY_FLOOR
+        self.extra_time = spendable * self.CRITICAL_TURN_SHARE if critical and spendable > 0 else 0
+        return self.extra_time
+
+    def record(self, seconds):
+        self.turn_times.append(seconds)
+        if self.act_timeout is not None:
+            self.remaining -= max(0, seconds - self.act_timeout)
+
+    @property
+    def time_limit(self):
+        """Seconds this turn may use, or None if unlimited."""
+        return None if self.act_timeout is None else self.act_timeout + self.extra_time
+
+
 class Clock:
+    """Day/night timing of one match, read from its game state."""
 
-    @staticmethod
-    def time_to_night():
+    def __init__(self, game_state):
+        self.g = game_state
+
+    def time_to_night(self):
         cycle_length = GAME_CONSTANTS['PARAMETERS']['DAY_LENGTH'] + GAME_CONSTANTS['PARAMETERS']['NIGHT_LENGTH']
-        return GAME_CONSTANTS['PARAMETERS']['DAY_LENGTH'] - (game.turn % cycle_length)
+        return GAME_CONSTANTS['PARAMETERS']['DAY_LENGTH'] - (self.g.turn % cycle_length)
 
     def is_night(self):
         return self.time_to_night() < 1
@@ -101,9 +204,6 @@ class Clock:
         return 10 if not self.is_night() else 10 + self.time_to_night()
 
 
-clock = Clock()
-
-
 class MyAgent:
 
     def __init__(self, game_state):
@@ -120,6 +220,11 @@ class MyAgent:
         self.num_cities = 0
         self.reserved_cells: Dict[Cell, Unit] = {}
         self.set_actions: Dict[Unit, str] = {}
+        self.unit_store = UnitStore()
+        self.clock = Clock(game_state)
+
+    def pos2cell(self, pos: Position) -> Cell:
+        return self.g.map.get_cell_by_pos(pos)
 
     def potential_new_worker_count(self):
         possible_workers = len(self.get_citytiles(self.player)) - len(self.player.units)
@@ -152,8 +257,7 @@ class MyAgent:
 
         # Update each zones list of opponent units
         for z in self.g.map.zones:
-            z.opponent_units = [u for u in self.opponent.units if pos2cell(u.pos) in (z.cells | set(z.perimeter_cells))]
-        zoneable_units = []
+            z.opponent_units = [u for u in self.opponent.units if z.contains(self.pos2cell(u.pos))]
         # zone_radius_restriction = max([4, self.g.turn])  # Expand zone radius as game progresses
         zones = [z for z in self.g.map.zones if
                  (z.resource_type == RESOURCE_TYPES.WOOD or
@@ -170,39 +274,33 @@ class MyAgent:
                         zone2cells[zone] = min(zone.resource_cells, key=lambda c: unit.pos.distance_to(c.pos))
                 # Draw ties by minimum zone saturation
                 unit.log.zone_closest = min(zone2cells, key=lambda z: (unit.pos.distance_to(zone2cells[z].pos), z.saturation))
-                if any([(self.can_unit_survive_to_cell(unit, pos2cell(z.centroid))) and z.is_unit_assignable(unit)
-                        for z in zones]):
-                    zoneable_units.append(unit)
-            every_zone_saturated = all([z.is_saturated for z in zones])
-            assignment_iteration = 0
-            initial_len_units = len(zoneable_units)
-            while len(zoneable_units) > 0 and not every_zone_saturated:
-                ignore_saturation = assignment_iteration > initial_len_units
-                if ignore_saturation:
-                    zones = sorted(zones, key=lambda z:z.saturation, reverse=True)
-                for zone in [z for z in zones if (not z.is_saturated) or ignore_saturation]:  # sorted by distance to starting pos
-                    # Assign units with cooldown as well for stability across turn assignments
-                    potential_units = [u for u in zoneable_units
-                                       if u.is_worker() and u.log.zone_assigned is None
-                                       and self.can_unit_survive_to_cell(u, pos2cell(zone.centroid))]
-                    if len(potential_units) > 0:
-                        unit = min(potential_units, key=lambda u: u.pos.distance_to(zone.centroid))
-                        unit.log.zone_assigned = zone
-                        zone.assigned_units.append(unit)
-                        zoneable_units.remove(unit)
-                    else:
-                        pass
-                    assignment_iteration += 1
-                    if len(zoneable_units) == 0:
-                        break
-                every_zone_saturated = all([z.is_saturated for z in zones])
-
-            # Assign any leftovers to their closest zone
-            for unit in zoneable_units:
-                zone = min(zones, key=lambda z: unit.pos.distance_to(z.centroid))
-                unit.log.zone_assigned = zone
-                zone.assigned_units.append(unit)
-                zoneable_units.remove(unit)
+            # Assign workers to zones in one batch, nearest centroid first within zone capacities.
+            # Workers can only be assigned zones they could survive the trip to.
+            # Assign units with cooldown as well for stability across turn assignments
+            # Workers keep last turn's zone while it is still valid and has room
+            zone_by_id = {z.zone_id: z for z in zones}
+            workers = []
+            for unit in [u for u in self.player.units if u.is_worker()]:
+                zone = zone_by_id.get(unit.log.zone_assigned_previous)
+                if (zone is not None and zone.remaining_capacity > 0 and zone.is_unit_assignable(unit)
+                        and self.can_unit_survive_to_cell(unit, self.pos2cell(zone.centroid))):
+                    unit.log.zone_assigned = zone
+                    zone.assigned_units.append(unit)
+                else:
+                    workers.append(unit)
+            cost = numpy.full((len(workers), len(zones)), math.inf)
+            for i, unit in enumerate(workers):
+                for j, zone in enumerate(zones):
+                    if zone.is_unit_assignable(unit) and self.can_unit_survive_to_cell(unit, self.pos2cell(zone.centroid)):
+                        cost[i, j] = unit.pos.distance_to(zone.centroid)
+            assignment = assign_with_capacities(cost, [z.remaining_capacity for z in zones])
+            for i, unit in enumerate(workers):
+                j = assignment[i]
+                if j == -1 and cost[i].min() < math.inf:  # Every zone it can reach is full, join the nearest anyway
+                    j = int(cost[i].argmin())
+                if j != -1:
+                    unit.log.zone_assigned = zones[j]
+                    zones[j].assigned_units.append(unit)
 
     def get_best_gather_cell_for_zone(self, unit, zone):
         """Assumes zone is logged for unit."""
@@ -213,8 +311,8 @@ class MyAgent:
         if zone.is_enclaved_by_opponent:
             # If zone is fully controlled by opponent, find CT soon to expire.
             cell = min(zone.opponent_citytiles, key=lambda ct: (ct.citytile.city.fuel, unit.pos.distance_to(ct.pos)))
-        elif z.is_enclaved and self.g.map.get_cell_by_pos(
-                unit.pos) not in zone.cells and zone.resource_type == RESOURCE_TYPES.WOOD:
+        elif z.is_enclaved and not zone.contains(self.g.map.get_cell_by_pos(
+                unit.pos)) and zone.resource_type == RESOURCE_TYPES.WOOD:
             cell = min(zone.player_citytiles, key=lambda ct: (ct.citytile.city.fuel, unit.pos.distance_to(ct.pos)))
         else:
             if z.resource_type == RESOURCE_TYPES.WOOD:
@@ -224,9 +322,10 @@ class MyAgent:
                     ordered_cell_groups = [z.resource_cells_not_adj_ct, z.resource_cells_adj_ct,  z.vacant_cells, z.player_citytiles_with_adj_opponent_unit, z.player_citytiles]
                 else:
                     ordered_cell_groups = [z.vacant_cells, z.player_citytiles_with_adj_opponent_unit, z.resource_cells_not_adj_ct, z.resource_cells_adj_ct]
+            assigned_gather_cells = set(self.unit_store.targets(Task.GATHER.value, int(z.zone_id)).tolist())
             for _ in range(2): # Loop twice, once with restriction then remove.
                 for zone_cells in ordered_cell_groups:
-                    filtered_cells = [vc for vc in zone_cells if vc not in z.assigned_gather_cells] if assigned_limit else zone_cells
+                    filtered_cells = [vc for vc in zone_cells if vc.index not in assigned_gather_cells] if assigned_limit else zone_cells
                     if len(filtered_cells) > 0:
                         cells = sorted(filtered_cells, key=lambda vc: (vc.pos.distance_to(unit.pos), vc.pos.distance_to(self.g.opponent_origin)))
                         for cell in cells:
@@ -259,20 +358,15 @@ class MyAgent:
         # Map to resource spots. TODO ignore those enclaved by opp
         self.set_resource_cells = []
         if len(self.resource_cells) > 0 and self.num_workers > 0:
-            u2rcbyw = {}  # unit 2 resourceCount by Weight
-            for unit in unassigned_workers:  # get worth values for each cell for each unassigned unit
-                u2rcbyw[unit] = self.get_resource_cells_by_worth(unit).items()
-            while len(u2rcbyw) > 0:
-                exploded = []
-                for u, rcbyw in u2rcbyw.items():  # For cells not yet set, explode out full rows for each unit
-                    exploded.extend([(u, rc, w) for u, (rc, w) in itertools.product([u, ], rcbyw) if
-                                     rc not in self.set_resource_cells])
-                if len(exploded) == 0:
-                    break
-                unit, rc, w = max(exploded, key=lambda triple: triple[2])  # assign best unit cell pairing by weight
-                unit.log.resource_cell = rc
-                del u2rcbyw[unit]
+            worth = self.get_resource_worth_matrix(unassigned_workers)
+            for _ in range(min(worth.shape)):
+                # assign best unit cell pairing by weight, then drop that unit and cell
+                i, j = numpy.unravel_index(worth.argmax(), worth.shape)
+                rc = self.resource_cells[j]
+                unassigned_workers[i].log.resource_cell = rc
                 self.set_resource_cells.append(rc)
+                worth[i, :] = -math.inf
+                worth[:, j] = -math.inf
 
     @staticmethod
     def get_citytiles(player) -> List[CityTile]:
@@ -299,8 +393,8 @@ class MyAgent:
     }
 
     def will_be_full_when_at_build_spot(self, worker: Unit, target_cell) -> bool:
-        cell = pos2cell(worker.pos)
-        resource_types = [rc.resource.type for rc in (self.g.map.get_adjacent_cells(cell) | {cell}) if rc.resource]
+        cell = self.pos2cell(worker.pos)
+        resource_types = [rc.resource.type for rc in (*self.g.map.get_adjacent_cells(cell), cell) if rc.resource]
         main_type = 'NA'
         if len(resource_types) > 0:
             if RESOURCE_TYPES.WOOD in resource_types:
@@ -317,7 +411,7 @@ class MyAgent:
         return est_cargo >= 100
 
     def get_potential_build_cell(self, unit: Unit) -> Cell:
-        return min([c for c in self.potential_city_cells], key=lambda c: unit.pos.distance_to(c.pos))
+        return self.distance_fields.nearest('potential_city', self.pos2cell(unit.pos))[0]
         # return max(self.prospective_citytile_weights.items(),
         #            key=lambda p: p[1] / (unit.pos.distance_to(p[0].pos)**(1.4) + 1))[0]
 
@@ -329,36 +423,25 @@ class MyAgent:
                     or cell.resource.type == RESOURCE_TYPES.COAL and self.player.research_points >= 50
                     or cell.resource.type == RESOURCE_TYPES.URANIUM and self.player.research_points >= 200)
 
-    @lru_cache(maxsize=1024)
     def can_unit_survive_to_cell(self, unit, target_cell):
         """Consider if unit can survive the next night cycle"""
-        distance_total = unit.pos.distance_to(target_cell.pos)
-        path = self.astar.search(pos2cell(unit.pos), target_cell, unit, limit=4)
-        distance_from_harvesting = 0
-        reserve = 0
-        # Try to estimate additional steps unit gains by harvesting along way.
-        # This is only really useful for night if a worker is on a CT (and hence has zero fuel)
-        for cell in path:
-            will_unit_harvest = self.is_harvestable(cell) or any(
-                [self.is_harvestable(adj) for adj in self.g.map.get_adjacent_cells(cell)])
-            if will_unit_harvest:
-                reserve += 1
-                distance_from_harvesting += 1
-            else:
-                reserve -= 1
-            if reserve < 0:
-                break
-        return distance_total <= unit.log.max_safe_distance + distance_from_harvesting
+        self.survival_queries += 1
+        field = self.survival_fields.get(unit.id)
+        if field is None:
+            # Steps unit can take before expiring. Harvesting along the way extends this, see get_survival_field.
+            field = self.g.map.get_survival_field(self.pos2cell(unit.pos), unit.log.max_safe_distance)
+            self.survival_fields[unit.id] = field
+        return field[target_cell.index] >= 0
 
     def determine_task_and_cell_zone(self, unit: Unit) -> (Task, Cell, 'MapZone'):
         zone = None
         if unit.log.zone_closest:
-            if unit.log.zone_closest.is_enclaved and pos2cell(unit.pos) in unit.log.zone_closest.resource_cells:
+            if unit.log.zone_closest.is_enclaved and unit.log.zone_closest.contains_resource(self.pos2cell(unit.pos)):
                 zone = unit.log.zone_closest
             else:
                 zone = unit.log.zone_assigned if unit.log.zone_assigned else unit.log.zone_closest
             # BUILD
-            if not clock.is_night():
+            if not self.clock.is_night():
                 should_build = True  # (len(self.opponent.citytiles) > len(self.player.citytiles)) or (len(great_ct_spots) > 0)
                 build_zone = None
                 if len(unit.log.zone_closest.vacant_cells) > 0:
@@ -379,13 +462,13 @@ class MyAgent:
                 cities = []
                 for c in self.player.cities.values():
                     ct = min(c.citytiles, key=lambda ct: ct.pos.distance_to(unit.pos))
-                    if self.can_unit_survive_to_cell(unit, pos2cell(ct.pos)):
+                    if self.can_unit_survive_to_cell(unit, self.pos2cell(ct.pos)):
                         cities.append((c, ct,))
                 cities = sorted(cities, key=lambda pair: len(pair[0].citytiles), reverse=True)
                 if len(cities) > 0:
                     deposit_ct = cities[0][1]
                 elif len(self.player.citytiles) > 0:
-                    deposit_ct = min(self.player.citytiles, key=lambda ct: ct.pos.distance_to(unit.pos))
+                    deposit_ct = self.distance_fields.nearest('player_citytiles', self.pos2cell(unit.pos))[0].citytile
                 if deposit_ct and (unit.pos.distance_to(deposit_ct.pos) < 10):
                     return Task.DEPOSIT, deposit_ct, zone
             # GATHER
@@ -393,41 +476,41 @@ class MyAgent:
             if gather_cell:
                 return Task.GATHER, gather_cell, zone
         if len(self.resource_locked_cells) > 0:
-            potential_wander_cell = min(self.resource_locked_cells, key=lambda c: unit.pos.distance_to(c.pos))
+            potential_wander_cell = self.distance_fields.nearest('resource_locked', self.pos2cell(unit.pos))[0]
             return Task.WANDER, potential_wander_cell, zone
         else:  # Do anything...
             if len(self.opponent.citytiles) > 0:
-                cell = min(self.opponent.citytiles, key=lambda ct: unit.pos.distance_to(ct.pos))
+                cell = self.distance_fields.nearest('opponent_citytiles', self.pos2cell(unit.pos))[0]
             else:
-                midpoint = Position(self.height // 2, self.width // 2)
+                midpoint = Position.at(self.height // 2, self.width // 2)
                 cell = self.g.map.get_cell_by_pos(midpoint)
             return Task.KETTLE, cell, zone
 
+    def setup_resource_worth(self):
+        """Worth of each resource cell before distance is considered: the resources on and around the cell,
+        diluted by adjacent player citytiles. Aligned with self.resource_cells."""
+        m = self.g.map
+        player_ct = (m.citytile_owner == self.g.id).astype(int)
+        worth = cross_sum(m.resource_amount) / (1 + 2 * cross_sum(player_ct, centre=False))
+        self.resource_ys, self.resource_xs = numpy.nonzero(self.resource_mask)
+        self.resource_worth = worth[self.resource_ys, self.resource_xs]
+        # t2n = max(0, self.clock.time_to_night())
+
+    def get_resource_worth_matrix(self, units: List[Unit]) -> numpy.ndarray:
+        """Worth of each resource cell (columns) to each unit (rows), divided by the distance to it."""
+        xs = numpy.array([u.pos.x for u in units]).reshape(-1, 1)
+        ys = numpy.array([u.pos.y for u in units]).reshape(-1, 1)
+        distance = numpy.abs(xs - self.resource_xs) + numpy.abs(ys - self.resource_ys)
+        return self.resource_worth / numpy.maximum(1, distance)
+
     def get_resource_cells_by_worth(self, unit: Unit) -> Dict[Cell, float]:
-        rc2worth = {}
-        for rc in self.resource_cells:
-            rcs = {rc, } | self.g.map.get_adjacent_cells(rc)
-            value_total = 0
-            ct_count = 1
-            for rc_adj in rcs:
-                value = 0
-                if rc_adj.resource:
-                    value = rc_adj.resource.amount  # * self.resource2value[rc_adj.resource.type]
-                elif rc_adj.citytile and rc_adj.citytile in self.player.citytiles:
-                    ct_count += 2
-                    value = 0
-
-                value_total += value
-            value_total /= ct_count
-            # t2n = max(0, clock.time_to_night())
-            rc2worth[rc] = value_total / (max(1, unit.pos.distance_to(rc.pos)))
-        return rc2worth
+        return dict(zip(self.resource_cells, self.get_resource_worth_matrix([unit])[0].tolist()))
 
     def _past_get_resource_cells_by_worth(self, unit: Unit) -> Dict[Cell, float]:
         rc2worth = {}
         for rc in self.resource_cells:
             # TODO - value by individual resources, devalue expiring trees
-            rcs = {rc, } | self.g.map.get_adjacent_cells(rc)
+            rcs = (rc, *self.g.map.get_adjacent_cells(rc))
             rc2worth[rc] = (sum([rc.resource.amount for rc in rcs if rc.resource]) / (unit.pos.distance_to(rc.pos) + 1))
         return rc2worth
 
@@ -438,32 +521,44 @@ class MyAgent:
             if unit.log.resource_cell is not None:
                 cell = unit.log.resource_cell
             else:  # If no cell was assigned initially, default to best cell for that unit
-                cell = max(self.get_resource_cells_by_worth(unit).items(), key=lambda x: x[1])[0]
+                cell = self.resource_cells[int(self.get_resource_worth_matrix([unit])[0].argmax())]
         elif task == Task.SAFE_GATHER:  # Go to nearest gather point
             if len(self.resource_cells) > 0:
-                cell = min(self.resource_cells, key=lambda rc: unit.pos.distance_to(rc.pos))
+                cell = self.distance_fields.nearest('resource', self.pos2cell(unit.pos))[0]
             elif len(self.resource_locked_cells) > 0:
-                cell = min(self.resource_locked_cells, key=lambda rc: unit.pos.distance_to(rc.pos))
+                cell = self.distance_fields.nearest('resource_locked', self.pos2cell(unit.pos))[0]
         elif task == Task.BUILD:
             cell = self.get_potential_build_cell(unit)
         elif task == Task.DEPOSIT:
-            cell = pos2cell(unit.log.citytile.pos)
+            cell = self.pos2cell(unit.log.citytile.pos)
         elif task == Task.WANDER:
-            cell = min(self.resource_locked_cells, key=lambda c: unit.pos.distance_to(c.pos))
+            cell = self.distance_fields.nearest('resource_locked', self.pos2cell(unit.pos))[0]
         elif task == Task.KETTLE:
             if len(self.opponent.citytiles) > 0:
-                cell = min(self.opponent.citytiles, key=lambda c: unit.pos.distance_to(c.pos))
+                cell = self.distance_fields.nearest('opponent_citytiles', self.pos2cell(unit.pos))[0]
             else:
                 cell = self.g.map[self.height // 2, self.width // 2]
         else:
             print(f"WARNING: unit {unit} found with task {task} without defined behaviour here.")
-            cell = pos2cell(unit.pos)
+            cell = self.pos2cell(unit.pos)
         return cell
 
+    def is_search_priority(self, unit: Unit, task: Task) -> bool:
+        """Units on citytiles, builders and units that will not last the night keep their searches longest."""
+        return (self.pos2cell(unit.pos).citytile is not None or task == Task.BUILD
+                or (self.clock.is_night() and unit.will_not_survive_night(self.clock.remaining_night())))
+
     def pathfind(self, initial_cell: Cell, task: Task, target_cell: Cell, unit: Unit) -> DIRECTIONS:
         if initial_cell == target_cell:
             return 'c'
-        path = self.astar.search(pos2cell(initial_cell.pos), pos2cell(target_cell.pos), unit, limit=self.ASTAR_LIMIT)
+        if not self.search_budget.can_search(self.is_search_priority(unit, task)):
+            # Out of time for this unit. Step straight towards the target, plan_unit will find another cell if taken.
+            return initial_cell.pos.direction_to(target_cell.pos)
+        if self.pos2cell(target_cell.pos) in self.shared_target_cells:  # One field serves every unit heading here
+            path = self.flow_fields.get(self.pos2cell(target_cell.pos)).get_path(initial_cell)
+        else:
+            path = self.astar.search(self.pos2cell(initial_cell.pos), self.pos2cell(target_cell.pos), unit,
+                                     limit=self.search_budget.limit)
         if len(path) > 0:
             # Annotate
             cell1 = initial_cell
@@ -474,6 +569,14 @@ class MyAgent:
             next_cell = path.popleft()
             return initial_cell.pos.direction_to(next_cell.pos)
         print(f"CAUTION: No path found! Trying any available spot")
+        for action, cell in self.get_candidate_moves(initial_cell, task, target_cell):
+            if not self.g.map.is_set_cell(cell):
+                return action
+        print(f"Alert: pathfinding defaulting to Center for {initial_cell}", file=sys.stderr)
+        return DIRECTIONS.CENTER
+
+    def get_candidate_moves(self, initial_cell: Cell, task: Task, target_cell: Cell) -> List[tuple]:
+        """(direction, cell) for every cell a unit could step to, closest to target first. Ignores reservations."""
         check_dirs = [
             DIRECTIONS.NORTH,
             DIRECTIONS.EAST,
@@ -481,53 +584,44 @@ class MyAgent:
             DIRECTIONS.WEST,
             DIRECTIONS.CENTER,
         ]
-        closest_dist = None  #
-        closest_dir = None
+        candidates = []
         for direction in check_dirs:
             newpos = initial_cell.pos.translate(direction, 1)
             if self.g.map.is_valid_position(newpos):
-                not_reserved = pos2cell(newpos) not in self.g.map.set_cells.values()
-                not_enemy_ct = newpos not in [ct.pos for ct in self.opponent.citytiles]
-                build_penalty = 1 if (task == Task.BUILD) and (pos2cell(newpos).citytile is not None) else 0
+                cell = self.pos2cell(newpos)
+                not_enemy_ct = not self.g.map.opponent_ct_mask[cell.index]
+                build_penalty = 1 if (task == Task.BUILD) and (cell.citytile is not None) else 0
                 # wait_penalty = 1.1 if (task == Task.BUILD) and (initial_cell != target_cell) else 0
-                if not_reserved and not_enemy_ct:
+                if not_enemy_ct:
                     dist = target_cell.pos.distance_to(newpos) + build_penalty
-                    if closest_dist is None or dist < closest_dist:
-                        closest_dir = direction
-                        closest_dist = dist
-        if closest_dir is None:
-            print(f"Alert: pathfinding defaulting to North for {initial_cell}", file=sys.stderr)
-            closest_dir = DIRECTIONS.NORTH  # TODO - Weight directions and pick least worst in this case.
-        return closest_dir
+                    candidates.append((dist, direction, cell))
+        return [(direction, cell) for _, direction, cell in sorted(candidates, key=lambda c: c[0])]
 
     def determine_action_for_cell(self, unit: Unit, task: Task, cell: Cell) -> (str, Cell):
         if not unit.pos.equals(cell.pos):
-            action = self.pathfind(pos2cell(unit.pos), task, cell, unit)
+            action = self.pathfind(self.pos2cell(unit.pos), task, cell, unit)
         else:
             if task == Task.GATHER:
-                action = self.pathfind(pos2cell(unit.pos), task, cell, unit)
+                action = self.pathfind(self.pos2cell(unit.pos), task, cell, unit)
             elif task == Task.BUILD:
                 action = 'bcity'
             elif task == Task.DEPOSIT:
-                action = self.pathfind(pos2cell(unit.pos), task, cell, unit)
+                action = self.pathfind(self.pos2cell(unit.pos), task, cell, unit)
             else:  # Task.WANDER
-                action = self.pathfind(pos2cell(unit.pos), task, cell, unit)
-        return action, pos2cell(unit.pos.translate(action2direction[action], 1))
+                action = self.pathfind(self.pos2cell(unit.pos), task, cell, unit)
+        return action, self.pos2cell(unit.pos.translate(action2direction[action], 1))
 
     def setup_resource_cells(self):
         """Collect resource tiles. Ignore advanced materials if unobtainable so far."""
-        self.resource_cells: List[Cell] = []
-        self.resource_locked_cells: List[Cell] = []
-        for cell in self.g.map:
-            if cell.has_resource():
-                ignore_coal = cell.resource.type == Constants.RESOURCE_TYPES.COAL and (
-                        self.IGNORE_COAL)
-                ignore_uranium = cell.resource.type == Constants.RESOURCE_TYPES.URANIUM and (
-                        self.IGNORE_URANIUM)
-                if ignore_coal or ignore_uranium:
-                    self.resource_locked_cells.append(cell)
-                else:
-                    self.resource_cells.append(cell)
+        m = self.g.map
+        locked = numpy.zeros_like(m.has_resource)
+        if self.IGNORE_COAL:
+            locked |= m.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.COAL]
+        if self.IGNORE_URANIUM:
+            locked |= m.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.URANIUM]
+        self.resource_mask = m.has_resource & ~locked
+        self.resource_cells: List[Cell] = m.cells_from_mask(self.resource_mask)
+        self.resource_locked_cells: List[Cell] = m.cells_from_mask(m.has_resource & locked)
 
     def setup_potential_city_cells(self):
         """Collect resource tiles. Ignore advanced materials if unobtainable so far.
@@ -537,46 +631,140 @@ class MyAgent:
             - adj ct + across from ct
             - across from ct
         """
-        cells: set[Cell] = set()
-        for cell in self.resource_cells:
-            cells |= {c for c in self.g.map.get_adjacent_cells(cell) if not c.has_resource() and not c.has_city_tile()}
-        self.potential_city_cells = cells
-
-    def get_astar_limit(self):
-        nunits = len(self.player.units)
-        if nunits < 40:
-            return 8
-        elif nunits < 50:
-            return 4
-        else:
-            return 2
+        m = self.g.map
+        mask = adjacent_mask(self.resource_mask) & ~m.has_resource & ~m.has_citytile
+        self.potential_city_cells: set[Cell] = set(m.cells_from_mask(mask))
+
+    def setup_distance_fields(self):
+        """Nearest target lookups by path distance, see DistanceFields."""
+        self.distance_fields = DistanceFields(self.g.map)
+        self.distance_fields.set_targets('potential_city', self.potential_city_cells)
+        self.distance_fields.set_targets('resource', self.resource_cells)
+        self.distance_fields.set_targets('resource_locked', self.resource_locked_cells)
+        self.distance_fields.set_targets('player_citytiles', [self.pos2cell(ct.pos) for ct in self.player.citytiles])
+        self.distance_fields.set_targets('opponent_citytiles', [self.pos2cell(ct.pos) for ct in self.opponent.citytiles])
 
     def generate_stats(self):
-        self.ASTAR_LIMIT = self.get_astar_limit()
         self.setup_resource_cells()
+        self.setup_resource_worth()
         # self.setup_prospective_citytile_weights()
         self.setup_potential_city_cells()
+        self.setup_distance_fields()
 
     def confirm_commands(self, u, c):
         if u.can_act():  # Avoids warnings about units not able to act even when acting to stay still.
             self.set_commands.append(get_command_from_action(u, self.prospective_actions[u]))
             self.set_actions[u] = self.prospective_actions[u]
-        self.g.map.set_cells[u] = c
+            if self.prospective_actions[u] == 'bcity':
+                self.g.map.add_citytile_cost(c)
+                self.flow_fields.clear()
+        self.g.map.add_set_cell(u, c)
+
+    def is_cell_free(self, unit: Unit, cell: Cell) -> bool:
+        """Player citytiles can be shared. Other cells are free unless another unit is set to be there next turn."""
+        if self.g.map.opponent_ct_mask[cell.index]:
+            return False
+        return cell.citytile is not None or not self.g.map.is_set_cell(cell) \
+            or self.g.map.set_cells.get(unit) is cell
+
+    def determine_tasks(self, units: List[Unit]):
+        """One time task determination. This is not dependant on set actions of other workers."""
+        for unit in units:
+            task, cell_target, zone = self.determine_task_and_cell_zone(unit)
+            self.unit_store.set_task(unit.id, task.value, self.pos2cell(cell_target.pos).index,
+                                     int(zone.zone_id) if zone is not None else -1)
+            unit.log.task = task
+            unit.log.cell_target = cell_target
+        # Targets requested by several units are pathed to with a shared flow field rather than a search each
+        cell2units = group_units_by_requested_cells({u: self.pos2cell(u.log.cell_target.pos) for u in units})
+        self.shared_target_cells = {cell for cell, requesters in cell2units.items() if len(requesters) > 1}
+
+    def plan_units(self, units: List[Unit]):
+        """Plan each worker once, in priority order. Workers in the way are planned early, see plan_unit."""
+        self.planning = set()
+        self.actable_unit_cells = {self.pos2cell(u.pos): u for u in units if self.pos2cell(u.pos).citytile is None}
+        for unit in units:
+            if unit not in self.planning:
+                self.plan_unit(unit)
+        self.unit_store.update_frustration()
+
+    def is_critical_turn(self) -> bool:
+        """Turns worth spending overage on: map analysis on turn 0, the first turn of night, and nights where
+        several citytiles are at risk of expiring."""
+        if self.g.turn == 0 or self.clock.time_to_night() == 0:
+            return True
+        tiles_at_risk = sum(len(c.citytiles) for c in self.player.cities.values() if c.will_not_survive_night())
+        return self.clock.time_to_night() < 5 and tiles_at_risk >= MASS_EXPIRY_CITYTILES
+
+    def get_counters(self) -> Dict[str, int]:
+        """Work done this turn, for TurnProfiler."""
+        return {
+            'units': len(self.player.units),
+            'astar_searches': self.astar.searches,
+            'astar_expansions': self.astar.expansions,
+            'flow_fields': len(self.flow_fields.fields),
+            'distance_fields': len(self.distance_fields.fields),
+            'survival_hits': self.survival_queries - len(self.survival_fields),
+            'survival_misses': len(self.survival_fields),
+            'greedy_moves': self.search_budget.greedy_moves,
+            'frustrated_units': int((self.unit_store.frustration[:self.unit_store.size] >= FRUSTRATED_TURNS).sum()),
+        }
+
+    def plan_unit(self, unit: Unit):
+        """Set the action of unit against the cells set for next turn.
+        Candidates are the pathfinding move, then a re-path around the cells set so far, then any other move closest
+        to target first. A worker standing in a candidate cell is planned first and keeps the cell if its own task
+        holds it there, so workers are never pushed off a resource or build site. No worker enters the cell of one
+        still being planned, which leaves every worker its own cell to stay on and keeps moves collision free."""
+        self.planning.add(unit)
+        cell_current = self.pos2cell(unit.pos)
+        task, cell_target = unit.log.task, unit.log.cell_target
+        action, cell_next = self.determine_action_for_cell(unit, task, cell_target)
+        if self.claim_cell(unit, cell_next):
+            return self.set_unit_action(unit, action, cell_next)
+        action, cell_next = self.determine_action_for_cell(unit, task, cell_target)  # Searches avoid set cells
+        if self.claim_cell(unit, cell_next):
+            return self.set_unit_action(unit, action, cell_next)
+        for action, cell in self.get_candidate_moves(cell_current, task, cell_target):
+            if self.claim_cell(unit, cell):
+                return self.set_unit_action(unit, action, cell)
+        self.set_unit_action(unit, 'c', cell_current)
+
+    def claim_cell(self, unit: Unit, cell: Cell) -> bool:
+        """Whether unit can be set on cell. A worker standing there is planned first, to see if it moves off."""
+        if not self.is_cell_free(unit, cell):
+            return False
+        occupant = self.actable_unit_cells.get(cell)
+        if occupant is None or occupant is unit:
+            return True
+        if occupant in self.planning and occupant not in self.g.map.set_cells:  # Further up this chain
+            return False
+        if occupant not in self.planning:
+            self.plan_unit(occupant)
+        return self.is_cell_free(unit, cell)
+
+    def set_unit_action(self, unit: Unit, action, cell_next: Cell):
+        self.prospective_actions[unit] = action
+        unit.log.action = action
+        unit.log.cell_next = cell_next
+        self.unit_store.set_next(unit.id, cell_next.index)
+        self.confirm_commands(unit, cell_next)
 
     def set_nonacting_workers(self):
         nonactable_worker_units = [u for u in self.player.units if u.is_worker() and not u.can_act()]
         for unit in nonactable_worker_units:
             unit.log.action = 'c'
-            unit.log.cell_next = pos2cell(unit.pos)
-            if pos2cell(unit.pos).citytile is None:
+            unit.log.cell_next = self.pos2cell(unit.pos)
+            self.unit_store.set_next(unit.id, unit.log.cell_next.index)
+            if self.pos2cell(unit.pos).citytile is None:
                 self.prospective_actions[unit] = 'c'
-                self.confirm_commands(unit, pos2cell(unit.pos))
+                self.confirm_commands(unit, self.pos2cell(unit.pos))
 
     def set_transfer_commands(self):
         for u in self.player.units:
             recipiant, cell = None, None
             if u.is_worker() and u.can_act:
-                cell = pos2cell(u.pos)
+                cell = self.pos2cell(u.pos)
                 if cell.resource:
                     adj_units = [c.unit for c in self.g.map.get_adjacent_cells(cell)
                                  if c.unit is not None and c.unit in self.player.units and c.resource is None and c.citytile is None]
@@ -589,11 +777,11 @@ class MyAgent:
 
     def get_max_safe_distance_for_unit(self, unit):
         """Consider if unit can survive the next night cycle"""
-        current_resource_type = pos2cell(unit.pos).resource.type if pos2cell(
+        current_resource_type = self.pos2cell(unit.pos).resource.type if self.pos2cell(
             unit.pos).resource is not None else 'NA'
         # Assume at most unit will traverse 2 additional steps and harvest along the way
         est_cargo = unit.cargo.sum_total() + self.resource2unitsperturn[current_resource_type] * 2
-        initial_distance_covered_in_light = max(0, clock.time_to_night() + 1) // 2
+        initial_distance_covered_in_light = max(0, self.clock.time_to_night() + 1) // 2
         distance = initial_distance_covered_in_light
         while est_cargo > 0:
             if est_cargo > 40:
@@ -618,7 +806,7 @@ class MyAgent:
             #     self.set_commands.append(annotate.circle(c.pos.x, c.pos.y))
             # self.set_commands.append(annotate.line(z.centroid.x, z.centroid.y, self.g.players_initial_positions[self.g.id].x, self.g.players_initial_positions[self.g.id].y))
 
-    def get_actions(self, g):
+    def get_actions(self, g, turn_start=None, time_limit=None):
         """
         Changelog
             - go to build if anticipate meeting 100 cargo
@@ -635,7 +823,8 @@ class MyAgent:
                 - go to nearest unsaturated zone
         """
         turn = g.turn
-        self.can_unit_survive_to_cell.cache_clear()
+        self.survival_fields: Dict[str, List[int]] = {}  # Per turn, keyed by unit id
+        self.survival_queries = 0
         self.IGNORE_COAL = self.player.research_points <= map_height_params[self.g.map_height]['ignore_coal_limit']
         self.IGNORE_URANIUM = self.player.research_points <= map_height_params[self.g.map_height]['ignore_uranium_limit']
         self.set_commands = []
@@ -649,10 +838,14 @@ class MyAgent:
         self.set_log_values()
         # self.produce_workers()
         self.reserved_cells: Dict[Cell] = {}
-        units2prospective_cell: Dict[Unit] = {}
         self.set_actions: Dict[Unit] = {}
-        self.g.map.set_cells: Dict[Unit] = {}
+        self.g.map.clear_set_cells()
+        self.unit_store.sync(self.player.units, self.width)
         self.astar = Astar(self.g.map, g.turn)
+        self.search_budget = SearchBudget(time.perf_counter() if turn_start is None else turn_start, time_limit,
+                                          len(self.player.units))
+        self.flow_fields = FlowFields(self.g.map)
+        self.shared_target_cells = set()
         self.zone_units()
         self.prospective_actions: Dict[Unit] = {}
         # Determine unit actions
@@ -663,46 +856,13 @@ class MyAgent:
         #   units on a CT
         #   units not near resources
         actable_worker_units = sorted(
-            actable_worker_units, key=lambda u: (pos2cell(u.pos).citytile is None,
+            actable_worker_units, key=lambda u: (self.pos2cell(u.pos).citytile is None,
                                                  any([c.resource is not None for c in
-                                                      (self.g.map.get_adjacent_cells(pos2cell(u.pos)) | {pos2cell(u.pos)})
+                                                      (*self.g.map.get_adjacent_cells(self.pos2cell(u.pos)), self.pos2cell(u.pos))
                                                       ]))
         )
-        action_iter = 0
-        # One time task determination. This is not dependant on set actions of other workers.
-        for unit in actable_worker_units:
-            task, cell_target, zone = self.determine_task_and_cell_zone(unit)
-            if task == Task.GATHER and zone is not None:
-                zone.assigned_gather_cells.append(cell_target)
-            unit.log.task = task
-            unit.log.cell_target = cell_target
-
-        while len(self.set_actions) < len(actable_worker_units):
-            action_iter += 1
-            if action_iter > 24:
-                raise Exception(f"action resolution iteration > 24 - probable infinite loop")
-            unassigned_worker_units = [u for u in actable_worker_units if u not in self.set_actions]
-            self.prospective_actions = {}
-            units2prospective_cell = {}
-            for unit in unassigned_worker_units:
-                action, cell_next = self.determine_action_for_cell(unit, unit.log.task, unit.log.cell_target)
-                self.prospective_actions[unit] = action
-                units2prospective_cell[unit] = cell_next
-                # Update log
-                unit.log.action = action
-                unit.log.cell_next = cell_next
-
-            # ACTION CONFLICT RESOLUTION
-            # Confirm non-conflicting actions. Record set actions in ship log to keep track of
-            # how many ships actions are finalized. Resolve actions outwards from shipyards.
-            cell2units = group_units_by_requested_cells(units2prospective_cell)
-            for cell, units in cell2units.items():
-                if cell.citytile is None:  # Give spot to highest priority ship
-                    unit = max(units, key=lambda u: pos2cell(u.pos).citytile is not None)
-                    self.confirm_commands(unit, cell)
-                else:
-                    for unit in units:
-                        self.confirm_commands(unit, cell)
+        self.determine_tasks(actable_worker_units)
+        self.plan_units(actable_worker_units)
 
         # Annotations
         # for unit in self.player.units:
@@ -713,15 +873,55 @@ class MyAgent:
         return self.set_commands
 
 
+def get_act_timeout(config):
+    """Seconds allowed per turn, or None if unlimited. No config (main.py) means the standard Lux limit."""
+    if config is None:
+        return DEFAULT_ACT_TIMEOUT
+    return config.get('actTimeout') or None
+
+
+class LuxBot:
+    """
+    All state of one match: game, agent, time bank and profiler. Instances share nothing, so any number of matches
+    can be played interleaved in one process. A step 0 observation starts a new match on the same instance.
+    """
+
+    def __init__(self):
+        self.game = None
+        self.myagent = None
+        self.time_bank = None
+        self.profiler = None
+
+    def act(self, obs, config=None) -> List[str]:
+        turn_start = time.perf_counter()
+        # Initalize game else update
+        if obs.step == 0:
+            self.profiler = TurnProfiler.from_env(obs.player)
+            # Game parses the turn 0 observation as it is built, so that parse is timed as this turn's update
+            self.game = self.profiler.call('update', Game, obs) if self.profiler else Game(obs)
+            self.myagent = MyAgent(self.game)
+            self.time_bank = TimeBank(get_act_timeout(config))
+            if self.profiler:
+                self.profiler.wrap(self.game, 'update')
+                self.profiler.wrap(self.game.map, 'generate_zones')
+                self.profiler.wrap(self.myagent, 'get_actions', 'generate_stats', 'zone_units', 'determine_tasks',
+                                   'plan_units')
+        else:
+            self.game.update(obs)
+        print(f'Turn:{obs.step}', file=sys.stderr)
+        self.time_bank.start_turn(obs, self.myagent.is_critical_turn())
+        actions = self.myagent.get_actions(self.game, turn_start=turn_start, time_limit=self.time_bank.time_limit)
+        self.time_bank.record(time.perf_counter() - turn_start)
+        if self.profiler:
+            self.profiler.emit(obs.step, {**self.myagent.get_counters(),
+                                          'overage_granted': round(self.time_bank.extra_time, 3),
+                                          'overage_remaining': round(self.time_bank.remaining, 3)})
+        return actions
+
+
+kaggle_bot = LuxBot()
+
+
 def agent(obs, config):
-    global game, myagent, log
-    # Initalize game else update
-    if obs.step == 0:
-        game = Game(obs)
-        myagent = MyAgent(game)
-        log = Log()
-    else:
-        game.update(obs)
-    print(f'Turn:{obs.step}', file=sys.stderr)
-    actions = myagent.get_actions(game)
-    return actions
+    """Kaggle entry point - one match at a time, played by the module's LuxBot."""
+    return kaggle_bot.act(obs, config)
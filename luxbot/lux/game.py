@@ -1,4 +1,6 @@
 import sys
+from typing import Dict, List, Set
+
 from .constants import Constants
 from .game_map import GameMap, Cell
 from .game_objects import Player, Unit, City, CityTile
@@ -21,6 +23,13 @@ class Game:
         self.map_width = int(mapinfo[0])
         self.map_height = int(mapinfo[1])
         self.map = GameMap(self.map_width, self.map_height)
+        # Cells carrying state from the last update, used to clear stale state on the next one
+        self.resource_cells: Set[Cell] = set()
+        self.unit_cells: List[Cell] = []
+        self.citytile_cells: Set[Cell] = set()
+        self.road_cells: Set[Cell] = set()
+        self.id2unit: Dict[str, Unit] = {}
+        self.id2city: Dict[str, City] = {}
         self.update(obs, init=True)
         self.players_initial_positions = [p.citytiles[0].pos for p in self.players]
         self.player_origin = self.players_initial_positions[self.id]
@@ -38,22 +47,28 @@ class Game:
         print("D_FINISH")
 
     def _reset_player_states(self):
-        self.players[0].units = []
-        self.players[0].cities = {}
-        self.players[0].citytiles = []
-        self.players[0].city_tile_count = 0
-        self.players[1].units = []
-        self.players[1].cities = {}
-        self.players[1].citytiles = []
-        self.players[1].city_tile_count = 0
+        for player in self.players:
+            player.units = []
+            player.cities = {}
+            player.citytiles = []
+            player.city_tile_count = 0
 
     def update(self, obs, init=False):
         """
         update state
+
+        The map, units, cities and citytiles persist for the whole match and are updated in place, so object
+        identity is stable across turns. Cells touched by last turns updates but absent from this turns are cleared.
         """
-        self.map = GameMap(self.map_width, self.map_height)
         self.turn = obs.step
         self._reset_player_states()
+        for cell in self.unit_cells:
+            cell.unit = None
+        self.map.unit_count.fill(0)
+        self.map.unit_cooldown.fill(0)
+        resource_cells, unit_cells, citytile_cells, road_cells = set(), [], set(), set()
+        id2unit: Dict[str, Unit] = {}
+        id2city: Dict[str, City] = {}
 
         for update in obs.updates:
             if update == "D_DONE":
@@ -69,6 +84,7 @@ class Game:
                 y = int(strs[3])
                 amt = int(float(strs[4]))
                 self.map.setResource(r_type, x, y, amt)
+                resource_cells.add(self.map.get_cell(x, y))
             elif input_identifier == INPUT_CONSTANTS.UNITS:
                 unittype = int(strs[1])
                 team = int(strs[2])
@@ -79,15 +95,29 @@ class Game:
                 wood = int(strs[7])
                 coal = int(strs[8])
                 uranium = int(strs[9])
-                unit = Unit(team, unittype, unitid, x, y, cooldown, wood, coal, uranium)
+                cell = self.map.get_cell(x, y)
+                unit = self.id2unit.get(unitid)
+                if unit is None:
+                    unit = Unit(team, unittype, unitid, x, y, cooldown, wood, coal, uranium)
+                unit.update(cell.pos, cooldown, wood, coal, uranium)
+                id2unit[unitid] = unit
                 self.players[team].units.append(unit)
-                self.map.get_cell(x, y).unit = unit
+                cell.unit = unit
+                unit_cells.append(cell)
+                self.map.unit_count[team, y, x] += 1
+                self.map.unit_cooldown[y, x] = cooldown
             elif input_identifier == INPUT_CONSTANTS.CITY:
                 team = int(strs[1])
                 cityid = strs[2]
                 fuel = float(strs[3])
                 lightupkeep = float(strs[4])
-                self.players[team].cities[cityid] = City(team, cityid, fuel, lightupkeep)
+                city = self.id2city.get(cityid)
+                if city is None:
+                    city = City(team, cityid, fuel, lightupkeep)
+                else:
+                    city.update(fuel, lightupkeep)
+                id2city[cityid] = city
+                self.players[team].cities[cityid] = city
             elif input_identifier == INPUT_CONSTANTS.CITY_TILES:
                 team = int(strs[1])
                 cityid = strs[2]
@@ -95,15 +125,45 @@ class Game:
                 y = int(strs[4])
                 cooldown = float(strs[5])
                 city = self.players[team].cities[cityid]
-                citytile = city.add_city_tile(x, y, cooldown, self.id)
+                cell = self.map.get_cell(x, y)
+                citytile = cell.citytile
+                if citytile is not None and citytile.team == team:
+                    citytile.update(city, cooldown)
+                    city.citytiles.append(citytile)
+                else:
+                    citytile = city.add_city_tile(x, y, cooldown, self.id)
+                    cell.citytile = citytile
                 self.players[team].citytiles.append(citytile)
-                self.map.get_cell(x, y).citytile = citytile
                 self.players[team].city_tile_count += 1
+                citytile_cells.add(cell)
+                self.map.citytile_owner[y, x] = team
+                self.map.citytile_cooldown[y, x] = cooldown
+                self.map.city_fuel[y, x] = city.fuel
             elif input_identifier == INPUT_CONSTANTS.ROADS:
                 x = int(strs[1])
                 y = int(strs[2])
                 road = float(strs[3])
-                self.map.get_cell(x, y).road = road
+                cell = self.map.get_cell(x, y)
+                cell.road = road
+                road_cells.add(cell)
+                self.map.road[y, x] = road
+
+        # Clear state that was not refreshed this turn: depleted resources, destroyed citytiles and worn roads.
+        for cell in self.resource_cells - resource_cells:
+            self.map.clearResource(cell.pos.x, cell.pos.y)
+        for cell in self.citytile_cells - citytile_cells:
+            cell.citytile = None
+            self.map.citytile_owner[cell.pos.y, cell.pos.x] = -1
+            self.map.citytile_cooldown[cell.pos.y, cell.pos.x] = 0
+            self.map.city_fuel[cell.pos.y, cell.pos.x] = 0
+        for cell in self.road_cells - road_cells:
+            cell.road = 0
+            self.map.road[cell.pos.y, cell.pos.x] = 0
+        self.resource_cells, self.unit_cells, self.citytile_cells, self.road_cells = \
+            resource_cells, unit_cells, citytile_cells, road_cells
+        self.id2unit, self.id2city = id2unit, id2city
+        self.map.update_masks(self.id)
+        self.map.update_traverse_cost(self.players[self.id].research_points)
 
         if not init:  # Need to have generated players_initial_positions in the init update before using this
             self.map.generate_zones(self.id, self.players_initial_positions[self.id])
@@ -1,14 +1,31 @@
 import heapq
+import math
 from collections import deque
-from typing import List, Set, Iterator, Dict, Deque
+from functools import lru_cache
+from typing import List, Set, Iterator, Dict, Deque, Tuple
+
+import numpy
 
 from .constants import Constants
+from .game_constants import GAME_CONSTANTS
 
 DIRECTIONS = Constants.DIRECTIONS
 RESOURCE_TYPES = Constants.RESOURCE_TYPES
 
+# Position hashes are x * stride + y, unique for any coordinate within +-stride / 2 of the map.
+POSITION_HASH_STRIDE = 1 << 16
+
+# Integer codes used by GameMap.resource_type. 0 is no resource.
+RESOURCE_TYPE_IDS = {
+    RESOURCE_TYPES.WOOD: 1,
+    RESOURCE_TYPES.COAL: 2,
+    RESOURCE_TYPES.URANIUM: 3,
+}
+
 
 class Resource:
+    __slots__ = ('type', 'amount')
+
     def __init__(self, r_type: str, amount: int):
         self.type = r_type
         self.amount = amount
@@ -18,8 +35,11 @@ class Resource:
 
 
 class Cell:
+    __slots__ = ('pos', 'index', 'resource', 'citytile', 'unit', 'road', 'zone')
+
     def __init__(self, x, y):
-        self.pos = Position(x, y)
+        self.pos = Position.at(x, y)
+        self.index: int = None  # Flat cell id y * width + x, assigned by GameMap
         self.resource: Resource = None
         self.citytile = None
         self.unit = None
@@ -37,10 +57,24 @@ class Cell:
 
 
 class Position:
+    """Grid coordinate. Treat as immutable: positions are interned by Position.at and shared by every map, cell,
+    unit and citytile at that coordinate."""
+    __slots__ = ('x', 'y')
+    _interned: Dict[int, 'Position'] = {}
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
 
+    @classmethod
+    def at(cls, x, y) -> 'Position':
+        """The shared Position for (x, y)."""
+        key = x * POSITION_HASH_STRIDE + y
+        pos = cls._interned.get(key)
+        if pos is None:
+            pos = cls._interned[key] = cls(x, y)
+        return pos
+
     def __sub__(self, pos: 'Position') -> int:
         return abs(pos.x - self.x) + abs(pos.y - self.y)
 
@@ -67,18 +101,18 @@ class Position:
 
     def translate(self, direction, units) -> 'Position':
         if direction == DIRECTIONS.NORTH:
-            return Position(self.x, self.y - units)
+            return Position.at(self.x, self.y - units)
         elif direction == DIRECTIONS.EAST:
-            return Position(self.x + units, self.y)
+            return Position.at(self.x + units, self.y)
         elif direction == DIRECTIONS.SOUTH:
-            return Position(self.x, self.y + units)
+            return Position.at(self.x, self.y + units)
         elif direction == DIRECTIONS.WEST:
-            return Position(self.x - units, self.y)
+            return Position.at(self.x - units, self.y)
         elif direction == DIRECTIONS.CENTER:
-            return Position(self.x, self.y)
+            return self
 
     def __hash__(self):
-        return (str(self.x) + str(self.y)).__hash__()
+        return self.x * POSITION_HASH_STRIDE + self.y
 
     def direction_to(self, target_pos: 'Position') -> DIRECTIONS:
         """
@@ -115,14 +149,18 @@ class MapZone:
         - Centroid is a Position() estimate of the zones centre. It may not lie on a resource
         - Distance is from the original players starting citytile
         - MapZones may share cititiles and vacent cells.
+        - Membership is a flat byte string of MEMBER/RESOURCE/PERIMETER flags indexed by cell id. The category lists
+          are derived from the same planes, in row-major order.
     """
+    MEMBER, RESOURCE, PERIMETER = 1, 2, 4
 
-    def __init__(self, zone_id, zone_cells, resource_type, player_id, player_initial_position, game_map):
+    def __init__(self, zone_id, zone_mask, resource_type, player_id, player_initial_position, game_map):
         self.zone_id = str(zone_id)
         self.player_id = player_id
         self.resource_type = resource_type
         self.centroid: Position = None
         self.distance = None
+        self.membership: bytes = b''
         self.cells: List[Cell] = []
         self.perimeter_cells: List[Cell] = []
         self.resource_cells: List[Cell] = []
@@ -136,8 +174,7 @@ class MapZone:
         self.opponent_citytiles: List[Cell] = []
         self.player_initial_position = player_initial_position
         self.game_map = game_map
-        self.create_from_cells(zone_cells)
-        self.assigned_gather_cells = []
+        self.create_from_mask(zone_mask)
         self.assigned_units = []
         self.opponent_units = []
 
@@ -175,44 +212,47 @@ class MapZone:
     def remaining_capacity(self):
         return max(0, self.capacity - len(self.assigned_units))
 
+    def contains(self, cell: Cell) -> bool:
+        return bool(self.membership[cell.index] & MapZone.MEMBER)
+
+    def contains_resource(self, cell: Cell) -> bool:
+        return bool(self.membership[cell.index] & MapZone.RESOURCE)
+
     def is_unit_assignable(self, unit: 'Unit'):
-        return (not self.is_enclaved) or (self.game_map.get_cell_by_pos(unit.pos) in self.cells)
+        return (not self.is_enclaved) or self.contains(self.game_map.get_cell_by_pos(unit.pos))
 
     # def get_unassigned_gather_cells(self):
     #     cell_groups = [self.vacant_cells, self.player_citytiles_with_adj_opponent_unit, self.resource_cells_adj_ct,
     #      self.resource_cells_not_adj_ct, self.player_citytiles]
     #     return [c for cg in cell_groups for c in cg if c not in self.assigned_gather_cells]
 
-    def create_from_cells(self, cells):
-        self.cells = cells
-        for c in cells:
+    def create_from_mask(self, zone_mask: numpy.ndarray):
+        m = self.game_map
+        player_ct = m.citytile_owner == self.player_id
+        resource = zone_mask & (m.resource_type > 0)
+        citytile = zone_mask & m.has_citytile
+        vacant = zone_mask & ~resource & ~citytile
+        # Zone cells that are not resources with a neighbour outside the zone. Each cell is listed once.
+        perimeter = zone_mask & ~resource & adjacent_mask(~zone_mask)
+        resource_adj_ct = resource & adjacent_mask(m.has_citytile)
+        opponent_unit_adj = adjacent_mask(m.unit_count[1 - self.player_id] > 0)
+
+        self.membership = (zone_mask * MapZone.MEMBER | resource * MapZone.RESOURCE
+                           | perimeter * MapZone.PERIMETER).astype(numpy.uint8).tobytes()
+        self.cells = m.cells_from_mask(zone_mask)
+        self.perimeter_cells = m.cells_from_mask(perimeter)
+        self.resource_cells = m.cells_from_mask(resource)
+        self.resource_cells_adj_ct = m.cells_from_mask(resource_adj_ct)
+        self.resource_cells_not_adj_ct = m.cells_from_mask(resource & ~resource_adj_ct)
+        self.player_citytiles = m.cells_from_mask(citytile & player_ct)
+        self.player_citytiles_with_adj_opponent_unit = m.cells_from_mask(citytile & player_ct & opponent_unit_adj)
+        self.opponent_citytiles = m.cells_from_mask(citytile & ~player_ct)
+        self.vacant_cells = m.cells_from_mask(vacant)
+        self.vacant_cells_no_adj_player_ct = m.cells_from_mask(vacant & ~adjacent_mask(player_ct))
+        for c in self.cells:
             c.zone = self
-            if c.resource:
-                self.resource_cells.append(c)
-                if any([adj.citytile is not None for adj in self.game_map.get_adjacent_cells(c)]):
-                    self.resource_cells_adj_ct.append(c)
-                else:
-                    self.resource_cells_not_adj_ct.append(c)
-            elif c.citytile:
+            if c.citytile:
                 c.citytile.zone = self
-                if c.citytile.team == self.player_id:
-                    self.player_citytiles.append(c)
-                    if any([adj.unit is not None and adj.unit.team != self.player_id for adj in
-                            self.game_map.get_adjacent_cells(c)]):
-                        self.player_citytiles_with_adj_opponent_unit.append(c)
-                else:
-                    self.opponent_citytiles.append(c)
-            else:
-                if all([((adj.citytile is None) or (adj.citytile.team != self.player_id))
-                        for adj in
-                        self.game_map.get_adjacent_cells(c)]):
-                    self.vacant_cells_no_adj_player_ct.append(c)
-                self.vacant_cells.append(c)
-        # Determine perimeter cells
-        for c in (self.vacant_cells + self.player_citytiles + self.opponent_citytiles):
-            for adj in self.game_map.get_adjacent_cells(c):
-                if adj not in self.cells:
-                    self.perimeter_cells.append(c)
 
         self.centroid = calculate_centroid(self.resource_cells)
         self.distance = self.centroid.distance_to(self.player_initial_position)
@@ -230,8 +270,37 @@ class GameMap:
             self.map[y] = [None] * width
             for x in range(0, self.width):
                 self.map[y][x] = Cell(x, y)
+        self.cells: List[Cell] = [c for row in self.map for c in row]  # Indexed by flat cell id
+        for index, cell in enumerate(self.cells):
+            cell.index = index
+        self.adjacent: List[Tuple[Cell, ...]] = [tuple(self.cells[i] for i in ids)
+                                                 for ids in neighbour_table(width, height)]
         self.zones: List[MapZone] = []
-        self.set_cells: Dict['Unit', Cell] = {}  # Keep track of cells assigned by other units
+        # Resource components behind the zones, see label_resource_components
+        self.components: Dict[int, List[int]] = {}  # Zone id to flat ids of its resource cells
+        self.component_labels: List[int] = [-1] * (width * height)  # Zone id of each resource cell, else -1
+        self.component_resource_type = numpy.zeros(width * height, dtype=numpy.int8)  # resource_type when labelled
+        self.zone_id_counter = 0
+        # Per turn reservations: the cell each unit is set to be on next turn, and the reverse index by flat cell id.
+        # Citytiles can hold several units.
+        self.set_cells: Dict['Unit', Cell] = {}
+        self.set_cell_units: Dict[int, List['Unit']] = {}
+        # Per turn adjacency filters, indexed by flat cell id
+        self.set_cell_count: List[int] = [0] * (width * height)  # Units set to be on the cell next turn
+        self.opponent_ct_mask: List[bool] = [False] * (width * height)
+        self.player_ct_on_wood_mask: List[bool] = [False] * (width * height)
+        # Per turn path costs, indexed by flat cell id
+        self.traverse_cost: List[int] = [2] * (width * height)  # See update_traverse_cost
+        self.harvestable_mask: List[bool] = [False] * (width * height)  # Player can harvest on or next to the cell
+        # State planes indexed [y, x], kept in sync with the cells by Game.update
+        self.resource_type = numpy.zeros((height, width), dtype=numpy.int8)  # RESOURCE_TYPE_IDS, 0 if none
+        self.resource_amount = numpy.zeros((height, width), dtype=numpy.int32)
+        self.unit_count = numpy.zeros((2, height, width), dtype=numpy.int8)  # Units on cell, per team
+        self.unit_cooldown = numpy.zeros((height, width), dtype=numpy.float32)
+        self.citytile_owner = numpy.full((height, width), -1, dtype=numpy.int8)  # Team, -1 if no citytile
+        self.citytile_cooldown = numpy.zeros((height, width), dtype=numpy.float32)
+        self.city_fuel = numpy.zeros((height, width), dtype=numpy.float32)  # Fuel of the city owning the citytile
+        self.road = numpy.zeros((height, width), dtype=numpy.float32)
 
     def get_cell_by_pos(self, pos) -> Cell:
         return self.map[pos.y][pos.x]
@@ -247,29 +316,114 @@ class GameMap:
     def is_valid_position(self, pos: Position) -> bool:
         return 0 <= pos.x < self.width and 0 <= pos.y < self.height
 
+    def cells_from_mask(self, mask: numpy.ndarray) -> List[Cell]:
+        """Cells where mask is True, in the same row-major order as iterating the map."""
+        ys, xs = numpy.nonzero(mask)
+        return [self.map[y][x] for y, x in zip(ys.tolist(), xs.tolist())]
+
+    @property
+    def has_resource(self) -> numpy.ndarray:
+        return self.resource_amount > 0
+
+    @property
+    def has_citytile(self) -> numpy.ndarray:
+        return self.citytile_owner >= 0
+
     def get_adjacent_cells(self, cell: Cell, avoid_opponent_ct: bool = False, avoid_set_cells: bool = False,
-                           avoid_player_ct_on_wood: bool = False) -> Set[Cell]:
-        deltas = (
-            DIRECTIONS.NORTH,
-            DIRECTIONS.EAST,
-            DIRECTIONS.SOUTH,
-            DIRECTIONS.WEST,
-        )
-        positions = [cell.pos.translate(d, 1) for d in deltas]
-        cells = set()
-        avoid_opponent_ct_flag, avoid_set_cells_flag, avoid_player_ct_on_wood_flag = False, False, False
-        for cell in {self.get_cell_by_pos(p) for p in positions if self.is_valid_position(p)}:
-            if avoid_opponent_ct:
-                avoid_opponent_ct_flag = cell.citytile is not None and not cell.citytile.is_player_citytile()
-            if avoid_set_cells:
-                avoid_set_cells_flag = cell in self.set_cells.values()
-            if avoid_player_ct_on_wood:
-                any_adj_cells_on_wood = any([(ct.resource and ct.resource.type == RESOURCE_TYPES.WOOD)
-                                             for ct in self.get_adjacent_cells(cell)])
-                avoid_player_ct_on_wood_flag = cell.citytile is not None and cell.citytile.is_player_citytile() and any_adj_cells_on_wood
-            if not avoid_set_cells_flag and not avoid_opponent_ct_flag and not avoid_player_ct_on_wood_flag:  # Both flags should be false if adding to set.
-                cells.add(cell)
-        return cells
+                           avoid_player_ct_on_wood: bool = False) -> Tuple[Cell, ...]:
+        """Orthogonally adjacent cells, in N, E, S, W order. Filters are read from the per turn masks."""
+        adjacent = self.adjacent[cell.index]
+        if not (avoid_opponent_ct or avoid_set_cells or avoid_player_ct_on_wood):
+            return adjacent
+        return tuple(c for c in adjacent
+                     if not ((avoid_opponent_ct and self.opponent_ct_mask[c.index])
+                             or (avoid_set_cells and self.set_cell_count[c.index])
+                             or (avoid_player_ct_on_wood and self.player_ct_on_wood_mask[c.index])))
+
+    def update_masks(self, player_id):
+        """Refresh the adjacency filters from the state planes. Called once per turn after the map is updated."""
+        player_ct = self.citytile_owner == player_id
+        opponent_ct = self.has_citytile & ~player_ct
+        wood = self.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.WOOD]
+        self.opponent_ct_mask = opponent_ct.ravel().tolist()
+        self.player_ct_on_wood_mask = (player_ct & adjacent_mask(wood)).ravel().tolist()
+
+    def update_traverse_cost(self, research_points):
+        """Refresh the cost of entering each cell, as used by Astar. Called once per turn after the map is updated.
+            - Default 2 for moving 1 cell and resting
+            - 1 if unit will harvest. All else equal, move along resources.
+            - Large penalty (+10) for crossing a CT that will harvest wood
+        """
+        has_resource = self.resource_type > 0
+        wood = self.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.WOOD]
+        will_harvest = has_resource | adjacent_mask(has_resource)
+        cost = numpy.where(will_harvest, 1, 2) + numpy.where(self.has_citytile & adjacent_mask(wood), 10, 0)
+        self.traverse_cost = cost.ravel().tolist()
+        requirements = GAME_CONSTANTS["PARAMETERS"]["RESEARCH_REQUIREMENTS"]
+        harvestable = wood.copy()
+        if research_points >= requirements["COAL"]:
+            harvestable |= self.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.COAL]
+        if research_points >= requirements["URANIUM"]:
+            harvestable |= self.resource_type == RESOURCE_TYPE_IDS[RESOURCE_TYPES.URANIUM]
+        self.harvestable_mask = (harvestable | adjacent_mask(harvestable)).ravel().tolist()
+
+    def add_citytile_cost(self, cell: Cell):
+        """Update the cost of a cell a citytile is being built on this turn, without recomputing the grid."""
+        if self.traverse_cost[cell.index] < 10 and any(
+                [adj.resource is not None and adj.resource.type == RESOURCE_TYPES.WOOD for adj in self.adjacent[cell.index]]):
+            self.traverse_cost[cell.index] += 10
+
+    def get_survival_field(self, cell: Cell, budget) -> List[int]:
+        """Most non harvesting steps left on arriving at each cell from cell, -1 if unreachable within budget.
+        Entering a cell where the player can harvest (see harvestable_mask) is free, as the unit refuels on the way.
+        More steps left is always better, so the search over (cell, steps left) reduces to one value per cell and a
+        0-1 BFS. Opponent citytiles can be reached but not passed through."""
+        remaining = [-1] * (self.width * self.height)
+        remaining[cell.index] = budget
+        harvestable, blocked = self.harvestable_mask, self.opponent_ct_mask
+        queue = deque([cell.index])
+        while queue:
+            current = queue.popleft()
+            for adj_cell in self.adjacent[current]:
+                adj = adj_cell.index
+                remaining_adj = remaining[current] if harvestable[adj] else remaining[current] - 1
+                if remaining_adj > remaining[adj]:
+                    remaining[adj] = remaining_adj
+                    if blocked[adj]:  # Can be a destination, but not passed through
+                        continue
+                    if harvestable[adj]:
+                        queue.appendleft(adj)
+                    else:
+                        queue.append(adj)
+        return remaining
+
+    def clear_set_cells(self):
+        self.set_cells = {}
+        self.set_cell_units = {}
+        self.set_cell_count = [0] * (self.width * self.height)
+
+    def add_set_cell(self, unit: 'Unit', cell: Cell):
+        """Reserve cell for unit next turn, releasing any cell it held before."""
+        previous = self.set_cells.get(unit)
+        if previous is cell:
+            return
+        if previous is not None:
+            self.remove_set_cell(unit)
+        self.set_cells[unit] = cell
+        self.set_cell_units.setdefault(cell.index, []).append(unit)
+        self.set_cell_count[cell.index] += 1
+
+    def remove_set_cell(self, unit: 'Unit'):
+        cell = self.set_cells.pop(unit)
+        self.set_cell_units[cell.index].remove(unit)
+        self.set_cell_count[cell.index] -= 1
+
+    def is_set_cell(self, cell: Cell) -> bool:
+        return self.set_cell_count[cell.index] > 0
+
+    def get_set_cell_units(self, cell: Cell) -> List['Unit']:
+        """Units set to be on cell next turn."""
+        return self.set_cell_units.get(cell.index, [])
 
     def get_transverse_cells(self, cell: Cell) -> Set[Cell]:
         deltas = (
@@ -291,33 +445,20 @@ class GameMap:
         do not use this function, this is for internal tracking of state
         """
         cell = self.get_cell(x, y)
-        cell.resource = Resource(r_type, amount)
-
-    def explore_from_cell(self, cell: Cell, resource_type):
-        """Recursively explore cells, ignoring those already explored and building the explored list while traversing.
-        Each call
-            - Marks the argument cell as explored
-            - Appends cell to collection if applicable
-            - Begins further exploration if adjacent cells are applicable
+        if cell.resource is not None and cell.resource.type == r_type:
+            cell.resource.amount = amount
+        else:
+            cell.resource = Resource(r_type, amount)
+        self.resource_type[y, x] = RESOURCE_TYPE_IDS[r_type]
+        self.resource_amount[y, x] = amount
+
+    def clearResource(self, x, y):
+        """
+        do not use this function, this is for internal tracking of state
         """
-        cells = set()
-        cells |= {cell, }
-        self.assigned_cells |= {cell, }
-        for c in self.get_adjacent_cells(cell):
-            # Explore resource cells of the same type, not yet explored.
-            if c.resource and c.resource.type == resource_type and c not in self.assigned_cells:
-                cells |= self.explore_from_cell(c, resource_type)
-            else:  # Ignore other resource types
-                # self.explored_cells |= {c, }
-                pass
-                # TODO - Might change behaviour here later.
-                if c.citytile:  # Collect citytiles adjacent resource, but do not explore further from them
-                    cells |= {c, }
-                elif not c.resource:  # Collect empty adjacent tiles
-                    cells |= {c, }
-        return cells
-
-    assigned_cells = set()
+        self.get_cell(x, y).resource = None
+        self.resource_type[y, x] = 0
+        self.resource_amount[y, x] = 0
 
     restype2order = {
         RESOURCE_TYPES.WOOD: 0,
@@ -325,22 +466,73 @@ class GameMap:
         RESOURCE_TYPES.URANIUM: 2,
     }
 
+    def label_resource_components(self):
+        """Label connected components of same type resource cells, keeping zone ids stable across turns.
+        Resources only deplete, so components not touching a depleted cell are kept as they are. The rest are
+        relabelled with an iterative flood fill, and a component that split keeps its id on its largest part."""
+        resource_type = self.resource_type.ravel().tolist()
+        changed = numpy.nonzero(self.resource_type.ravel() != self.component_resource_type)[0].tolist()
+        if any(resource_type[i] for i in changed):  # New resources, relabel everything
+            stale = set(self.components)
+        else:
+            stale = {self.component_labels[i] for i in changed}
+        components = {zone_id: c for zone_id, c in self.components.items() if zone_id not in stale}
+        labelled = [False] * len(resource_type)
+        for component in components.values():
+            for i in component:
+                labelled[i] = True
+        new_components = []
+        for start in range(len(resource_type)):
+            if labelled[start] or not resource_type[start]:
+                continue
+            labelled[start] = True
+            component, stack = [], [start]
+            while stack:
+                current = stack.pop()
+                component.append(current)
+                for adj_cell in self.adjacent[current]:
+                    adj = adj_cell.index
+                    if not labelled[adj] and resource_type[adj] == resource_type[start]:
+                        labelled[adj] = True
+                        stack.append(adj)
+            new_components.append(sorted(component))
+        for component in sorted(new_components, key=len, reverse=True):
+            previous = [self.component_labels[i] for i in component if self.component_labels[i] in stale]
+            zone_id = max(set(previous), key=previous.count) if previous else None
+            if zone_id is None or zone_id in components:
+                zone_id = self.zone_id_counter
+                self.zone_id_counter += 1
+            components[zone_id] = component
+        self.components = components
+        self.component_labels = [-1] * len(resource_type)
+        for zone_id, component in components.items():
+            for i in component:
+                self.component_labels[i] = zone_id
+        self.component_resource_type = numpy.array(resource_type, dtype=numpy.int8)
+
     def generate_zones(self, player_id, player_initial_position):
         """Generate list of zones at the start of each turn.
+        Each zone is a resource component (see label_resource_components) plus the citytiles and empty cells next
+        to it. Zone ids carry across turns.
         List is sorted by distance to players initial turn 0 position descending.
         """
-        zone_id_counter = 0
         zones = []
-        self.assigned_cells = set()
-        all_resource_cells = set([cell for cell in self if cell.resource])
-        while len(self.assigned_cells) < len(all_resource_cells):
-            to_assign = list(all_resource_cells - self.assigned_cells)
-            next_cell = to_assign[0]
-            zone_cells = self.explore_from_cell(next_cell,
-                                                resource_type=next_cell.resource.type)  # search all adjacent cells if not_already_explored and (is_resource or is_myct or is enemy_ct)
-            zone = MapZone(zone_id_counter, zone_cells, next_cell.resource.type, player_id,
-                           player_initial_position, self)  # Zone IDs not guaranteed to translate across turns...
-            zone_id_counter += 1
+        # The map persists across turns, so clear zone references left over from the previous turn.
+        for zone in self.zones:
+            for c in zone.cells:
+                c.zone = None
+                if c.citytile:
+                    c.citytile.zone = None
+        self.label_resource_components()
+        zone_mask = numpy.zeros(self.width * self.height, dtype=bool)
+        for zone_id in sorted(self.components):
+            zone_mask[:] = False
+            zone_mask[self.components[zone_id]] = True
+            component = zone_mask.reshape(self.height, self.width)
+            # Collect adjacent citytiles and empty cells
+            zone_cells = component | (adjacent_mask(component) & (self.resource_type == 0))
+            resource_type = self.cells[self.components[zone_id][0]].resource.type
+            zone = MapZone(zone_id, zone_cells, resource_type, player_id, player_initial_position, self)
             zones.append(zone)
         # Sort zones by resource type readiness, then distance to player origin.
         # This is important for zone assignment to units later.
@@ -349,124 +541,280 @@ class GameMap:
                                            z.centroid.distance_to(z.player_initial_position)))
 
 
+@lru_cache(maxsize=None)
+def neighbour_table(width, height) -> Tuple[Tuple[int, ...], ...]:
+    """Flat ids of the orthogonal neighbours of every flat cell id, in N, E, S, W order. Shared by maps of a size."""
+    table = []
+    for y in range(height):
+        for x in range(width):
+            ids = []
+            if y > 0:
+                ids.append((y - 1) * width + x)
+            if x < width - 1:
+                ids.append(y * width + x + 1)
+            if y < height - 1:
+                ids.append((y + 1) * width + x)
+            if x > 0:
+                ids.append(y * width + x - 1)
+            table.append(tuple(ids))
+    return tuple(table)
+
+
+def adjacent_mask(mask: numpy.ndarray) -> numpy.ndarray:
+    """Cells orthogonally adjacent to any True cell of mask."""
+    adj = numpy.zeros_like(mask)
+    adj[1:, :] |= mask[:-1, :]
+    adj[:-1, :] |= mask[1:, :]
+    adj[:, 1:] |= mask[:, :-1]
+    adj[:, :-1] |= mask[:, 1:]
+    return adj
+
+
+def cross_sum(plane: numpy.ndarray, centre: bool = True) -> numpy.ndarray:
+    """Sum over each cell's orthogonal neighbours, and the cell itself if centre. A 3x3 cross shaped convolution."""
+    total = plane.copy() if centre else numpy.zeros_like(plane)
+    total[1:, :] += plane[:-1, :]
+    total[:-1, :] += plane[1:, :]
+    total[:, 1:] += plane[:, :-1]
+    total[:, :-1] += plane[:, 1:]
+    return total
+
+
 def calculate_centroid(cells) -> Position:
     xs, ys, n = 0, 0, len(cells)
     for cell in cells:
         xs += cell.pos.x
         ys += cell.pos.y
-    return Position(xs // n, ys // n)
-
-
-class Node:
-
-    def __init__(self, cell: Cell):
-        self.cell: Cell = cell
-        self.parent: Node = None
-        self.H = 0
-        self.G = 0
-
-    @property
-    def F(self):
-        return self.H + self.G
-
-    def get_path(self) -> Deque[Cell]:
-        """Follow trail of parent nodes to recreate path (excluding initial node)"""
-        path = deque()
-        node = self
-        while node.parent:
-            path.appendleft(node.cell)
-            node = node.parent
-        return path
-
-    def __eq__(self, other: 'Node'):
-        return self.cell == other.cell
-
-    def __hash__(self):
-        return self.cell.__hash__()
-
-    def __repr__(self):
-        return f"N({self.G}, {self.cell.__repr__()}"
+    return Position.at(xs // n, ys // n)
 
 
 class Astar:
+    """A* over flat cell ids. The open set is a binary heap with lazy deletion; G, parent and closed state live in
+    arrays indexed by cell id that are reused across searches and invalidated by bumping a generation counter."""
 
     def __init__(self, game_map: GameMap, turn):
-        # Open and closed sets are really key'd by the Cell the Node represents
         self.game_map: GameMap = game_map
-        self.open: Dict[Node, Node] = dict()
-        self.closed: Dict[Node, Node] = dict()
-        self.goal: Node = None
         self.unit: 'Unit' = None
         self.zone: MapZone = None
         self.turn = turn  # Change path finding behaviour at later stages
         self.SUSTAINABLE_WOOD_TURN_LIMIT = 280
+        n = game_map.width * game_map.height
+        self.G: List[float] = [0] * n
+        self.parent: List[int] = [-1] * n
+        self.order: List[int] = [0] * n  # Order cells were first reached in. Breaks ties between equal F.
+        self.seen: List[int] = [0] * n  # Generation a cell was last reached in
+        self.closed: List[int] = [0] * n  # Generation a cell was last expanded in
+        self.generation = 0
+        self.searches = 0
+        self.expansions = 0
 
     @staticmethod
-    def heuristic(node_current: Node, node_goal: Node):
+    def heuristic(cell: Cell, cell_goal: Cell):
         """L1 distance"""
-        return node_current.cell.pos.distance_to(node_goal.cell.pos)
+        return cell.pos.distance_to(cell_goal.pos)
 
     def cost_to_traverse(self, cell: Cell):
-        """Return a cost heuristic for how valuable this cell is as part of a path.
-            - Default 2 for moving 1 cell and resting
-            - 0.5 if unit will harvest. All else equal, move along resources.
-            - Large penalty for crossing a CT that will harvest wood
+        """Return a cost heuristic for how valuable this cell is as part of a path. See GameMap.update_traverse_cost.
 
         Ideally we would have a virtual unit and clock here and estimate if it would expire without resources
         """
-        will_unit_harvest = (cell.resource is not None) or any(
-            [adj.resource is not None for adj in self.game_map.get_adjacent_cells(cell)])
-        citytile_cost = 0
-        any_adj_cells_are_wood = any([(ct.resource and ct.resource.type == RESOURCE_TYPES.WOOD) for ct in
-                                      self.game_map.get_adjacent_cells(cell)])
-        if cell.citytile and any_adj_cells_are_wood:
-            citytile_cost = 10
-        return (1 if will_unit_harvest else 2) + citytile_cost
+        return self.game_map.traverse_cost[cell.index]
 
     def search(self, cell_start: Cell, cell_goal: Cell, unit: 'Unit', limit=None) -> Deque[Cell]:
-        """Search entrypoint. Initalise nodes.
+        """Search entrypoint.
         limit will reduce path search until only a limit of G has been covered."""
-        self.goal = Node(cell_goal)
-        self.open = dict()
-        self.closed = dict()
         self.unit = unit
+        self.searches += 1
         self.zone: MapZone = self.unit.log.zone_assigned if self.unit.log.zone_assigned else self.unit.log.zone_closest
-        node_current = Node(cell_start)
-        node_current.H = cell_start.pos.distance_to(cell_goal.pos)
-        return self._search(node_current, self.goal, limit=limit)
+        return self._search(cell_start, cell_goal, limit=limit)
 
-    def _search(self, current_node: Node, goal_node: Node, limit=8) -> Deque[Cell]:
-        self.open[current_node] = current_node
-        first_cell = current_node.cell
+    def get_path(self, index) -> Deque[Cell]:
+        """Follow trail of parents to recreate path (excluding initial cell)"""
+        path = deque()
+        cells = self.game_map.cells
+        while self.parent[index] != -1:
+            path.appendleft(cells[index])
+            index = self.parent[index]
+        return path
+
+    def _search(self, cell_start: Cell, cell_goal: Cell, limit=8) -> Deque[Cell]:
+        self.generation += 1
+        generation = self.generation
+        G, parent, order, seen, closed = self.G, self.parent, self.order, self.seen, self.closed
+        cells, traverse_cost = self.game_map.cells, self.game_map.traverse_cost
+        start, goal = cell_start.index, cell_goal.index
+        goal_x, goal_y = cell_goal.pos.x, cell_goal.pos.y
         avoid_player_ct_on_wood = self.zone is not None and (
-                self.game_map.get_cell_by_pos(self.unit.pos) not in self.zone.cells
+                not self.zone.contains(self.game_map.get_cell_by_pos(self.unit.pos))
                 and self.zone.resource_type == RESOURCE_TYPES.WOOD)
-        while current_node != goal_node:
-            if len(self.open) == 0 or (limit is not None and current_node.G > limit):
+        zone_enclaved = self.zone is not None and self.zone.is_enclaved
+        G[start], parent[start], order[start], seen[start] = 0, -1, 0, generation
+        counter = 1
+        expanded = 0
+        open_heap = [(self.heuristic(cell_start, cell_goal), 0, start)]  # (F, order, cell id)
+        current = start
+        while current != goal:
+            while open_heap and closed[open_heap[0][2]] == generation:  # Lazily drop entries superseded by a lower G
+                heapq.heappop(open_heap)
+            if len(open_heap) == 0 or (limit is not None and G[current] > limit):
                 # If no complete path is found, we return the best incomplete path from the current node
-                return current_node.get_path()
+                self.expansions += expanded
+                return self.get_path(current)
             # Get next best node
-            current_node = min(self.open, key=lambda node: node.F)
-            del self.open[current_node]
-            self.closed[current_node] = current_node
+            current = heapq.heappop(open_heap)[2]
+            closed[current] = generation
+            expanded += 1
             # Consider neighbours
-            avoid_set_cells = current_node.cell == first_cell  # Only avoid cells set this turn for other workers, if it is adjacent the origin cell.
-            avoid_opponent_ct = not (self.zone is not None and self.zone.is_enclaved) and current_node.G < 5  # Ignore opponent CTs at long distances
-            for adj_cell in self.game_map.get_adjacent_cells(current_node.cell, avoid_opponent_ct=avoid_opponent_ct,
+            avoid_set_cells = current == start  # Only avoid cells set this turn for other workers, if it is adjacent the origin cell.
+            avoid_opponent_ct = not zone_enclaved and G[current] < 5  # Ignore opponent CTs at long distances
+            for adj_cell in self.game_map.get_adjacent_cells(cells[current], avoid_opponent_ct=avoid_opponent_ct,
                                                              avoid_set_cells=avoid_set_cells,
                                                              avoid_player_ct_on_wood=avoid_player_ct_on_wood):
-                adj_node = Node(adj_cell)
-                adj_node.parent = current_node
+                adj = adj_cell.index
+                if closed[adj] == generation:
+                    continue
+                # G - actual acruing cost to get to the adj cell from the start
+                adj_G = G[current] + traverse_cost[adj]
+                if seen[adj] != generation:
+                    seen[adj] = generation
+                    order[adj] = counter
+                    counter += 1
+                elif adj_G >= G[adj]:  # Only replace a previously reached cell if it has a lower score
+                    continue
+                G[adj] = adj_G
+                parent[adj] = current
                 # H - estimate cost heuristic to get to the goal cell from here
-                adj_node.H = self.heuristic(adj_node, goal_node)
-                # G - actual acruing cost to get to the current cell from the start
-                adj_node.G = current_node.G + self.cost_to_traverse(adj_cell)
-                # If adj node was previously stored in open, and adj node has a lower F score, replace it
-                if adj_node in self.open:
-                    prev_node = self.open[adj_node]
-                    if prev_node.F > adj_node.F:
-                        self.open[adj_node] = adj_node
-                # If adj node has not been recorded in either open or closed, add to open
-                if adj_node not in self.open and adj_node not in self.closed:
-                    self.open[adj_node] = adj_node
-        return current_node.get_path()
+                adj_H = abs(adj_cell.pos.x - goal_x) + abs(adj_cell.pos.y - goal_y)
+                heapq.heappush(open_heap, (adj_G + adj_H, order[adj], adj))
+        self.expansions += expanded
+        return self.get_path(current)
+
+
+class FlowField:
+    """Cost to reach a set of goal cells, and the next step towards them, from every cell on the map.
+    Built with a reverse Dijkstra over GameMap.traverse_cost, so a path costs the same G that Astar would give it.
+    Opponent citytiles cannot be passed through, but may be goals."""
+
+    def __init__(self, game_map: GameMap, goals: Tuple[Cell, ...]):
+        self.game_map: GameMap = game_map
+        self.goals = goals
+        n = game_map.width * game_map.height
+        self.distance: List[float] = [math.inf] * n
+        self.next: List[int] = [-1] * n  # Flat id of the next cell on the way to the nearest goal
+        distance, next_, cost = self.distance, self.next, game_map.traverse_cost
+        adjacent, blocked = game_map.adjacent, game_map.opponent_ct_mask
+        open_heap = []
+        for cell in goals:
+            distance[cell.index] = 0
+            open_heap.append((0, cell.index))
+        heapq.heapify(open_heap)
+        while open_heap:
+            d, current = heapq.heappop(open_heap)
+            if d > distance[current]:
+                continue
+            d_adj = d + cost[current]  # Cost of stepping into current from a neighbour
+            for adj_cell in adjacent[current]:
+                adj = adj_cell.index
+                if d_adj < distance[adj] and not blocked[adj]:
+                    distance[adj] = d_adj
+                    next_[adj] = current
+                    heapq.heappush(open_heap, (d_adj, adj))
+
+    def next_cell(self, cell: Cell, avoid_set_cells: bool = True) -> Cell:
+        """Best adjacent cell to step to from cell, or None if no goal is reachable.
+        Cells set this turn for other units are avoided, as Astar does on the first step."""
+        best, best_distance = None, math.inf
+        cost = self.game_map.traverse_cost
+        for adj_cell in self.game_map.get_adjacent_cells(cell, avoid_opponent_ct=True, avoid_set_cells=avoid_set_cells):
+            d = cost[adj_cell.index] + self.distance[adj_cell.index]
+            if d < best_distance:
+                best, best_distance = adj_cell, d
+        return best
+
+    def get_path(self, cell: Cell) -> Deque[Cell]:
+        """Path from cell to the nearest reachable goal (excluding cell), empty if there is none."""
+        path = deque()
+        if self.distance[cell.index] == 0:  # Already on a goal
+            return path
+        next_cell = self.next_cell(cell)
+        if next_cell is None:
+            return path
+        cells = self.game_map.cells
+        index = next_cell.index
+        while index != -1:
+            path.append(cells[index])
+            index = self.next[index]
+        return path
+
+
+class FlowFields:
+    """FlowField cache keyed by goal cells. Built fresh each turn, so fields are evicted at the end of the turn."""
+
+    def __init__(self, game_map: GameMap):
+        self.game_map: GameMap = game_map
+        self.fields: Dict[Tuple[int, ...], FlowField] = {}
+
+    def get(self, *goals: Cell) -> FlowField:
+        key = tuple(sorted(c.index for c in goals))
+        field = self.fields.get(key)
+        if field is None:
+            field = self.fields[key] = FlowField(self.game_map, goals)
+        return field
+
+    def clear(self):
+        """Drop cached fields, e.g. after traversal costs have changed."""
+        self.fields = {}
+
+
+class DistanceField:
+    """Step count from every cell to the nearest of a set of source cells, and which source that is.
+    Built with a multi-source BFS. Opponent citytiles cannot be passed through, but may be sources."""
+
+    def __init__(self, game_map: GameMap, sources: Tuple[Cell, ...]):
+        n = game_map.width * game_map.height
+        self.distance: List[int] = [-1] * n  # -1 where no source is reachable
+        self.nearest: List[int] = [-1] * n  # Flat id of the nearest source
+        distance, nearest = self.distance, self.nearest
+        adjacent, blocked = game_map.adjacent, game_map.opponent_ct_mask
+        queue = deque()
+        for cell in sources:
+            distance[cell.index] = 0
+            nearest[cell.index] = cell.index
+            queue.append(cell.index)
+        while queue:
+            current = queue.popleft()
+            d = distance[current] + 1
+            for adj_cell in adjacent[current]:
+                adj = adj_cell.index
+                if distance[adj] == -1 and not blocked[adj]:
+                    distance[adj] = d
+                    nearest[adj] = nearest[current]
+                    queue.append(adj)
+
+
+class DistanceFields:
+    """Nearest target queries against named sets of target cells, e.g. 'resource' or 'opponent_citytiles'.
+    Each set's DistanceField is built on first use. Built fresh each turn."""
+
+    def __init__(self, game_map: GameMap):
+        self.game_map: GameMap = game_map
+        self.targets: Dict[str, Tuple[Cell, ...]] = {}
+        self.fields: Dict[str, DistanceField] = {}
+
+    def set_targets(self, name: str, cells):
+        self.targets[name] = tuple(sorted(cells, key=lambda c: c.index))
+        self.fields.pop(name, None)
+
+    def nearest(self, name: str, cell: Cell) -> Tuple[Cell, int]:
+        """Nearest target of the named set to cell and the steps needed to reach it. Targets that are walled off
+        from cell fall back to Manhattan distance. (None, math.inf) if the set is empty."""
+        field = self.fields.get(name)
+        if field is None:
+            field = self.fields[name] = DistanceField(self.game_map, self.targets[name])
+        index = field.nearest[cell.index]
+        if index != -1:
+            return self.game_map.cells[index], field.distance[cell.index]
+        if not self.targets[name]:
+            return None, math.inf
+        target = min(self.targets[name], key=lambda c: cell.pos.distance_to(c.pos))
+        return target, cell.pos.distance_to(target.pos)
@@ -34,6 +34,12 @@ class City:
     def __repr__(self):
         return f"C({self.cityid} fuel:{self.fuel} nights left:{(self.fuel//self.light_upkeep)})"
 
+    def update(self, fuel, light_upkeep):
+        """Refresh a city carried over from the previous turn. Citytiles are re-added as they are parsed."""
+        self.fuel = fuel
+        self.light_upkeep = light_upkeep
+        self.citytiles.clear()
+
     def add_city_tile(self, x, y, cooldown, playerid):
         ct = CityTile(self, x, y, cooldown, playerid)
         self.citytiles.append(ct)
@@ -54,15 +60,24 @@ class City:
 
 
 class CityTile:
+    __slots__ = ('cityid', 'city', 'team', 'pos', 'cooldown', 'playerid', 'zone')
+
     def __init__(self, city, x, y, cooldown, playerid):
         self.cityid = city.cityid
         self.city = city
         self.team = city.team  # What player does this belong to?
-        self.pos = Position(x, y)
+        self.pos = Position.at(x, y)
         self.cooldown = cooldown
         self.playerid = playerid  # What player generated this?
         self.zone: MapZone = None
 
+    def update(self, city, cooldown):
+        """Refresh a citytile carried over from the previous turn. Cities merge, so the owning city may change."""
+        self.cityid = city.cityid
+        self.city = city
+        self.cooldown = cooldown
+        self.zone = None
+
     def is_player_citytile(self):
         return self.team == self.playerid
 
@@ -95,6 +110,8 @@ class CityTile:
 
 
 class Cargo:
+    __slots__ = ('wood', 'coal', 'uranium')
+
     def __init__(self):
         self.wood = 0
         self.coal = 0
@@ -116,6 +133,7 @@ class Cargo:
 
 
 class UnitLog:
+    """Per unit state, kept for the unit's lifetime. Values in resetable_names only hold for one turn."""
     city = None
     citytile = None
     resource_cell = None
@@ -130,11 +148,22 @@ class UnitLog:
     zone_assigned: MapZone = None
     zone_closest: MapZone = None
     zone_gather_cell: 'Cell' = None
+    zone_assigned_previous: str = None  # Zone id, as zones are rebuilt each turn
+    resetable_names = ['city', 'citytile', 'resource_cell', 'prospective_action', 'set_action', 'set_cell', 'action',
+                       'cell_next', 'max_safe_distance', 'zone_assigned', 'zone_closest', 'zone_gather_cell']
+
+    def reset_turn_values(self):
+        """Reset values that don't carry across turns."""
+        self.zone_assigned_previous = self.zone_assigned.zone_id if self.zone_assigned else None
+        for name in self.resetable_names:
+            setattr(self, name, None)
 
 
 class Unit:
+    __slots__ = ('pos', 'team', 'id', 'type', 'cooldown', 'cargo', 'log')
+
     def __init__(self, teamid, u_type, unitid, x, y, cooldown, wood, coal, uranium):
-        self.pos = Position(x, y)
+        self.pos = Position.at(x, y)
         self.team = teamid
         self.id = unitid
         self.type = u_type
@@ -148,6 +177,15 @@ class Unit:
     def __repr__(self):
         return f"U({self.type} {self.id})"
 
+    def update(self, pos, cooldown, wood, coal, uranium):
+        """Refresh a unit carried over from the previous turn. The log carries over, less its per turn values."""
+        self.pos = pos
+        self.cooldown = cooldown
+        self.cargo.wood = wood
+        self.cargo.coal = coal
+        self.cargo.uranium = uranium
+        self.log.reset_turn_values()
+
     def is_worker(self) -> bool:
         return self.type == UNIT_TYPES.WORKER
 
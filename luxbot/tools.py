@@ -1,60 +1,125 @@
-class LogEntry:
-    """Log values for each ship. Like a dictionary, without the ['fluff']"""
-
-    def __init__(self):
-        self.role = 'NEW'
-        self.role_suspended = None
-        self.target_cell = None   # Where ship wants to move based on role
-        self.spot = None            # assigned harvest spot
-        self.yard = None            # nearerst yard
-        self.squad = None
-        self.p_action = None
-        self.p_point = None
-        self.set_action = None
-        self.set_point = None
-        self.last_action = None
-        self.frustration = 0
-        self.is_frustrated = False
-        self.adj_allies = 0
-        self.adj_threats = 0
-        self.track_id = None
-        self.resetable_names = ['p_action', 'p_point', 'set_action', 'set_point', ]
-
-    def reset_turn_values(self):
-        """Reset values that don't carry across turns."""
-        for name in self.resetable_names:
-            setattr(self, name, None)
-
-    def __str__(self):
-        return f"R:{self.role} S:{self.spot} p_a:{self.p_action} p_p:{self.p_point}"
-
-
-class Log(dict):
-    """Super log to keep track of information across all ships.
-    Keys are ships. Values are a LogEntry()"""
-
-    def __init__(self):
-        super().__init__()
-        # Keep a reference to me - necessary to extract `next_actions`
-        self.board = None
-        self.me = None
-        self.harvest_spot_values = None
-        self.enemy_targ_ids = None
-        self.id2obj = None  # Map game id's to the objects regenerated each turn
-        self.squadrons = []
-
-    @property
-    def spots(self):  # Assigned harvest spots
-        return [x.spot for x in self.values() if x.spot is not None]
-
-    @property
-    def p_points(self):  # Potential next turn positions
-        return [x.p_point for x in self.values() if x.p_point is not None]
-
-    @property
-    def set_points(self):  # Assigned next turn positions
-        return [x.set_point for x in self.values() if x.set_point is not None]
-
-    @property
-    def set_actions(self):  # Assigned actions
-        return [x.set_action for x in self.values() if x.set_action is not None]
\ No newline at end of file
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+import numpy
+
+
+class UnitStore:
+    """Per unit state in columns, one row per unit, with an id to row index. Rows persist for a unit's lifetime.
+    Turn columns are reset together at the start of each turn, and queries across units are vectorised masks."""
+    TURN_COLUMNS = {'task': 0, 'target': -1, 'zone': -1, 'next': -1}
+    PERSISTENT_COLUMNS = {'frustration': 0}
+
+    def __init__(self, capacity=64):
+        self.id2row: Dict[str, int] = {}
+        self.size = 0
+        self.width = 0  # Of the map, to turn positions into flat cell ids
+        self.x = numpy.zeros(capacity, dtype=numpy.int32)
+        self.y = numpy.zeros(capacity, dtype=numpy.int32)
+        self.task = numpy.zeros(capacity, dtype=numpy.int32)  # Task value, 0 for none
+        self.target = numpy.full(capacity, -1, dtype=numpy.int32)  # Flat cell id
+        self.zone = numpy.full(capacity, -1, dtype=numpy.int32)  # Zone id of the task
+        self.next = numpy.full(capacity, -1, dtype=numpy.int32)  # Flat cell id set for next turn
+        self.frustration = numpy.zeros(capacity, dtype=numpy.int32)  # Turns in a row held in place short of target
+
+    def sync(self, units, width):
+        """Give this turn's units a row each, dropping units that no longer exist, and refresh their positions.
+        Turn columns are reset."""
+        n = len(units)
+        capacity = len(self.x)
+        while capacity < n:
+            capacity *= 2
+        old_rows = numpy.array([self.id2row.get(u.id, -1) for u in units], dtype=int)
+        for name, default in {**self.TURN_COLUMNS, **self.PERSISTENT_COLUMNS, 'x': 0, 'y': 0}.items():
+            column = getattr(self, name)
+            kept = numpy.where(old_rows >= 0, column[old_rows], default) if name in self.PERSISTENT_COLUMNS else None
+            if len(column) < capacity:
+                column = numpy.resize(column, capacity)
+                setattr(self, name, column)
+            column[:] = default
+            if kept is not None:
+                column[:n] = kept
+        self.id2row = {u.id: row for row, u in enumerate(units)}
+        self.size = n
+        self.x[:n] = [u.pos.x for u in units]
+        self.y[:n] = [u.pos.y for u in units]
+        self.width = width
+
+    def set_task(self, unit_id, task: int, target: int, zone: int):
+        row = self.id2row[unit_id]
+        self.task[row], self.target[row], self.zone[row] = task, target, zone
+
+    def set_next(self, unit_id, cell: int):
+        self.next[self.id2row[unit_id]] = cell
+
+    def targets(self, task: int, zone: int = None) -> numpy.ndarray:
+        """Flat cell ids targeted for task this turn, optionally only for tasks in zone."""
+        mask = self.task[:self.size] == task
+        if zone is not None:
+            mask &= self.zone[:self.size] == zone
+        return self.target[:self.size][mask]
+
+    def update_frustration(self):
+        """Count turns each unit was set to stay put while it has a target elsewhere. Units without a task this
+        turn, those cooling down after a move or a hold, keep their count."""
+        n = self.size
+        cell = self.y[:n] * self.width + self.x[:n]
+        planned = self.task[:n] != 0
+        held = (self.next[:n] == cell) & (self.target[:n] != cell)
+        self.frustration[:n] = numpy.where(planned, numpy.where(held, self.frustration[:n] + 1, 0),
+                                           self.frustration[:n])
+
+
+class TurnProfiler:
+    """Wall time per phase and work counters, written as one JSON line per turn.
+    Enabled by setting LUXBOT_PROFILE to a file path, or '-' for stderr. Phases are timed by wrapping bound methods
+    on the profiled objects, so when profiling is off nothing is wrapped and nothing is timed.
+    Each profiler covers one match, and its lines carry a match id (process id and a per-process count) and the
+    player, as several matches and processes may append to the same file."""
+    ENV_VAR = 'LUXBOT_PROFILE'
+    match_count = itertools.count(1)
+
+    def __init__(self, path, player=None):
+        self.path = path
+        self.match = f'{os.getpid()}-{next(self.match_count)}'
+        self.player = player
+        self.phases = {}
+
+    @classmethod
+    def from_env(cls, player=None):
+        path = os.environ.get(cls.ENV_VAR)
+        return cls(path, player) if path else None
+
+    def wrap(self, obj, *names):
+        """Time calls to obj.<name> as phase <name>. Nested phases are included in their parent's time."""
+        for name in names:
+            setattr(obj, name, self._timed(name, getattr(obj, name)))
+
+    def call(self, name, function, *args, **kwargs):
+        """Time one call as phase <name>, for work done before there is an object to wrap."""
+        return self._timed(name, function)(*args, **kwargs)
+
+    def _timed(self, name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+        return timed
+
+    def emit(self, turn, counters):
+        """Write the turn's phase times (ms) and counters, then start a new turn."""
+        line = json.dumps({'match': self.match, 'player': self.player, 'turn': turn,
+                           'ms': {name: round(t * 1000, 3) for name, t in self.phases.items()},
+                           'counters': counters}, separators=(',', ':'))
+        if self.path == '-':
+            print(line, file=sys.stderr)
+        else:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+        self.phases = {}
@@ -0,0 +1,33 @@
+"""
+Play bot versions against each other over many seeds, on the local forward model.
+
+$ python ./run-tournament.py --seeds 100                    # round robin of luxbot and every version under bots/
+$ python ./run-tournament.py --seeds 50 --gauntlet luxbot   # luxbot against each version
+$ python ./run-tournament.py --summary                      # standings from the results played so far
+
+Results are appended to the results file as games finish - rerunning the same command resumes where it stopped.
+"""
+import argparse
+
+import utils
+from utils.tournament import discover_bots, format_standings, load_results, run_tournament, standings
+
+parser = argparse.ArgumentParser(description='Round robin or gauntlet tournament between bot versions.')
+parser.add_argument('--seeds', type=int, default=20, help='number of seeds to play each pairing on')
+parser.add_argument('--first-seed', type=int, default=0)
+parser.add_argument('--bots', nargs='*', help='subset of bots to include (default: all discovered)')
+parser.add_argument('--gauntlet', help='play this bot against every other, rather than a round robin')
+parser.add_argument('--workers', type=int, help='worker processes (default: cpu count)')
+parser.add_argument('--results', default=str(utils.file_tournament_results), help='JSON lines results file')
+parser.add_argument('--summary', action='store_true', help='only print standings from the results file')
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    bots = discover_bots()
+    if args.bots:
+        bots = {name: path for name, path in bots.items() if name in args.bots}
+    if not args.summary:
+        seeds = range(args.first_seed, args.first_seed + args.seeds)
+        run_tournament(bots, seeds, args.results, gauntlet=args.gauntlet, workers=args.workers)
+    print(format_standings(standings(load_results(args.results), names=list(bots))))
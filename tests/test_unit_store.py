@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'luxbot'))
+
+from tools import UnitStore  # noqa: E402
+
+WIDTH = 12
+GATHER = 1
+
+
+def worker(x=3, y=4):
+    return SimpleNamespace(id='u_1', pos=SimpleNamespace(x=x, y=y))
+
+
+def hold_turn(store, unit, actable):
+    """One turn of a worker set to stay put short of its target. It only gets a task on turns it can act."""
+    store.sync([unit], WIDTH)
+    cell = unit.pos.y * WIDTH + unit.pos.x
+    if actable:
+        store.set_task(unit.id, GATHER, cell + 2, 0)
+    store.set_next(unit.id, cell)
+    store.update_frustration()
+
+
+def test_held_worker_reaches_threshold_across_cooldowns():
+    store, unit = UnitStore(), worker()
+    for _ in range(3):
+        hold_turn(store, unit, actable=True)
+        hold_turn(store, unit, actable=False)  # Cooling down after the hold
+    assert store.frustration[store.id2row[unit.id]] == 3
+
+
+def test_frustration_resets_once_the_worker_moves():
+    store, unit = UnitStore(), worker()
+    hold_turn(store, unit, actable=True)
+    hold_turn(store, unit, actable=False)
+    store.sync([unit], WIDTH)
+    cell = unit.pos.y * WIDTH + unit.pos.x
+    store.set_task(unit.id, GATHER, cell + 2, 0)
+    store.set_next(unit.id, cell + 1)
+    store.update_frustration()
+    assert store.frustration[store.id2row[unit.id]] == 0
@@ -13,6 +13,7 @@ pathdl = Path(f'{HOME}') / 'Downloads'  # Download location of replays
 file_run_replay_html = pathroot / 'replays_active' / 'run_replay.html'
 file_live_replay_html = pathroot / 'replays_active' / 'live_replay.html'
 file_run_replay_json = pathroot / 'replays_active' / 'run_replay.json'
+file_tournament_results = pathroot / 'replays_active' / 'tournament.jsonl'
 
 
 def write_html(run_html, file):
@@ -0,0 +1,597 @@
+"""Vectorised batch of Lux AI 2021 matches.
+
+Map state for N matches is held in [batch, y, x] NumPy arrays, and units and cities in [batch, slot] arrays, padded
+to the largest map so each rules phase runs once for the whole batch. Command parsing, collision resolution, unit
+spawning and city merging stay per match, as they depend on command order. Updates match `utils.sim.LuxSim`.
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .sim import CART, DEFAULT_CONFIG, DIRECTIONS, PARAMS, RESOURCE_ORDER, WORKER, LuxSim, Observation, _fmt, \
+    _parse_int
+
+OFFSETS = np.array(list(DIRECTIONS.values()))
+ADJACENT = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+RESOURCE_IDS = {r: k for k, r in enumerate(RESOURCE_ORDER)}
+COLLECTION_RATE = np.array([PARAMS['WORKER_COLLECTION_RATE'][r.upper()] for r in RESOURCE_ORDER])
+FUEL_RATE = np.array([PARAMS['RESOURCE_TO_FUEL_RATE'][r.upper()] for r in RESOURCE_ORDER])
+CAPACITY = np.array([PARAMS['RESOURCE_CAPACITY']['WORKER'], PARAMS['RESOURCE_CAPACITY']['CART']])
+UNIT_COOLDOWN = np.array([PARAMS['UNIT_ACTION_COOLDOWN']['WORKER'], PARAMS['UNIT_ACTION_COOLDOWN']['CART']])
+UNIT_UPKEEP = np.array([PARAMS['LIGHT_UPKEEP']['WORKER'], PARAMS['LIGHT_UPKEEP']['CART']])
+UNIT_FIELDS = ['unit_alive', 'unit_team', 'unit_type', 'unit_id', 'unit_x', 'unit_y', 'unit_cooldown', 'cargo']
+CITY_FIELDS = ['city_alive', 'city_team', 'city_id', 'city_fuel']
+
+
+class MatchPlan:
+    """One match's validated commands for a turn."""
+    __slots__ = ('moves', 'unit_actions', 'tile_actions')
+
+    def __init__(self):
+        self.moves: List[Tuple[int, int, str, Tuple[int, int]]] = []
+        self.unit_actions: Dict[int, tuple] = {}
+        self.tile_actions: List[Tuple[str, int, int, int]] = []
+
+
+class BatchSim:
+    """
+    N independent matches advanced together by `step`.
+
+    Build from seeds, or from `LuxSim` states (e.g. `LuxSim.from_observation`) to branch many matches off one
+    position. Matches that finish stop changing while the rest of the batch plays on.
+
+    Known deviation: two workers completing `bcity` on the same cell in the same turn (only possible on the cell of
+    a destroyed citytile) build one citytile, where the engine double counts the tile.
+    """
+
+    def __init__(self, seeds: Sequence[int] = (), sims: Optional[Sequence[LuxSim]] = None):
+        sims = list(sims) if sims is not None else [LuxSim(seed) for seed in seeds]
+        n = self.size = len(sims)
+        s = max(max(sim.width, sim.height) for sim in sims)
+        self.seeds = [sim.seed for sim in sims]
+        self.width = np.array([sim.width for sim in sims])
+        self.height = np.array([sim.height for sim in sims])
+        self.turn = np.array([sim.turn for sim in sims])
+        self.done = np.array([sim.done for sim in sims])
+        self.research = np.array([sim.research_points for sim in sims])
+        self.researched = np.array([[[r[k] for k in RESOURCE_ORDER] for r in sim.researched] for sim in sims])
+        self.unit_id_count = np.array([sim.global_unit_id_count for sim in sims])
+        self.city_id_count = np.array([sim.global_city_id_count for sim in sims])
+        self.order_count = np.zeros(n, np.int64)
+        self.warnings: List[List[str]] = [[] for _ in range(n)]
+
+        self.resource_type = np.full((n, s, s), -1, np.int8)
+        self.resource_amount = np.zeros((n, s, s), np.int64)
+        self.road = np.zeros((n, s, s))
+        self.ct_team = np.full((n, s, s), -1, np.int8)
+        self.ct_city = np.full((n, s, s), -1, np.int64)
+        self.ct_cooldown = np.zeros((n, s, s))
+        self.ct_adjacent = np.zeros((n, s, s), np.int64)
+        self.ct_order = np.zeros((n, s, s), np.int64)
+
+        self.unit_count = np.zeros(n, np.int64)
+        self.unit_slots: List[List[Dict[str, int]]] = [[{}, {}] for _ in range(n)]
+        self._allocate_units(max(sum(len(u) for u in sim.units) for sim in sims) + 16)
+        self.city_count = np.zeros(n, np.int64)
+        self._allocate_cities(max(len(sim.cities) for sim in sims) + 16)
+
+        for b, sim in enumerate(sims):
+            for row in sim.cells:
+                for cell in row:
+                    self.road[b, cell.y, cell.x] = cell.road
+                    if cell.resource_type is not None:
+                        self.resource_type[b, cell.y, cell.x] = RESOURCE_IDS[cell.resource_type]
+                        self.resource_amount[b, cell.y, cell.x] = cell.resource_amount
+            for team in (0, 1):
+                for unit in sim.units[team].values():
+                    slot = self._add_unit(b, unit.type, team, int(unit.id[2:]), unit.x, unit.y)
+                    self.unit_cooldown[b, slot] = unit.cooldown
+                    self.cargo[b, slot] = [unit.cargo[r] for r in RESOURCE_ORDER]
+            for city in sim.cities.values():
+                slot = self._add_city(b, city.team, int(city.id[2:]))
+                self.city_fuel[b, slot] = city.fuel
+                for cell in city.cells:
+                    self._set_citytile(b, city.team, slot, cell.x, cell.y, cell.citytile.adjacent)
+                    self.ct_cooldown[b, cell.y, cell.x] = cell.citytile.cooldown
+
+    # Storage
+
+    def _allocate_units(self, capacity):
+        n = self.size
+        self.unit_alive = np.zeros((n, capacity), bool)
+        self.unit_team = np.zeros((n, capacity), np.int8)
+        self.unit_type = np.zeros((n, capacity), np.int8)
+        self.unit_id = np.zeros((n, capacity), np.int64)
+        self.unit_x = np.zeros((n, capacity), np.int64)
+        self.unit_y = np.zeros((n, capacity), np.int64)
+        self.unit_cooldown = np.zeros((n, capacity))
+        self.cargo = np.zeros((n, capacity, 3), np.int64)
+
+    def _allocate_cities(self, capacity):
+        n = self.size
+        self.city_alive = np.zeros((n, capacity), bool)
+        self.city_team = np.zeros((n, capacity), np.int8)
+        self.city_id = np.zeros((n, capacity), np.int64)
+        self.city_fuel = np.zeros((n, capacity), np.int64)
+
+    def _grow(self, fields, capacity):
+        """Double the slot axis of the named arrays if `capacity` slots would not fit."""
+        current = getattr(self, fields[0]).shape[1]
+        if capacity <= current:
+            return
+        for name in fields:
+            array = getattr(self, name)
+            pad = [(0, 0)] * array.ndim
+            pad[1] = (0, max(current, capacity - current))
+            setattr(self, name, np.pad(array, pad))
+
+    def _add_unit(self, b, unit_type, team, unit_id, x, y):
+        slot = int(self.unit_count[b])
+        self._grow(UNIT_FIELDS, slot + 1)
+        self.unit_count[b] += 1
+        self.unit_alive[b, slot] = True
+        self.unit_team[b, slot] = team
+        self.unit_type[b, slot] = unit_type
+        self.unit_id[b, slot] = unit_id
+        self.unit_x[b, slot] = x
+        self.unit_y[b, slot] = y
+        self.unit_slots[b][team][f'u_{unit_id}'] = slot
+        return slot
+
+    def _add_city(self, b, team, city_id):
+        slot = int(self.city_count[b])
+        self._grow(CITY_FIELDS, slot + 1)
+        self.city_count[b] += 1
+        self.city_alive[b, slot] = True
+        self.city_team[b, slot] = team
+        self.city_id[b, slot] = city_id
+        return slot
+
+    def _set_citytile(self, b, team, city, x, y, adjacent=0):
+        self.ct_team[b, y, x] = team
+        self.ct_city[b, y, x] = city
+        self.ct_cooldown[b, y, x] = 0
+        self.ct_adjacent[b, y, x] = adjacent
+        self.ct_order[b, y, x] = self.order_count[b]
+        self.order_count[b] += 1
+
+    def _in_map(self, b, x, y):
+        return 0 <= x < self.width[b] and 0 <= y < self.height[b]
+
+    def is_night(self):
+        return self.turn % (PARAMS['DAY_LENGTH'] + PARAMS['NIGHT_LENGTH']) >= PARAMS['DAY_LENGTH']
+
+    # Per match state changes
+
+    def spawn_unit(self, b, unit_type, team, x, y):
+        self.unit_id_count[b] += 1
+        return self._add_unit(b, unit_type, team, int(self.unit_id_count[b]), x, y)
+
+    def spawn_city_tile(self, b, team, x, y):
+        adjacent = [(x + dx, y + dy) for dx, dy in ADJACENT
+                    if self._in_map(b, x + dx, y + dy) and self.ct_team[b, y + dy, x + dx] == team]
+        if not adjacent:
+            self.city_id_count[b] += 1
+            self._set_citytile(b, team, self._add_city(b, team, int(self.city_id_count[b])), x, y)
+            return
+        cities = list(dict.fromkeys(int(self.ct_city[b, ay, ax]) for ax, ay in adjacent))
+        city = cities[0]
+        self._set_citytile(b, team, city, x, y, len(adjacent))
+        for ax, ay in adjacent:
+            self.ct_adjacent[b, ay, ax] += 1
+        for merged in cities[1:]:
+            ys, xs = np.nonzero(self.ct_city[b] == merged)
+            for i in np.argsort(self.ct_order[b, ys, xs], kind='stable'):
+                self.ct_city[b, ys[i], xs[i]] = city
+                self.ct_order[b, ys[i], xs[i]] = self.order_count[b]
+                self.order_count[b] += 1
+            self.city_fuel[b, city] += self.city_fuel[b, merged]
+            self.city_alive[b, merged] = False
+
+    def transfer(self, b, src, dst, k, amount):
+        space = CAPACITY[self.unit_type[b, dst]] - self.cargo[b, dst].sum()
+        amount = min(amount, self.cargo[b, src, k], space)
+        self.cargo[b, src, k] -= amount
+        self.cargo[b, dst, k] += amount
+
+    def build_city(self, b, slot):
+        team, x, y = int(self.unit_team[b, slot]), int(self.unit_x[b, slot]), int(self.unit_y[b, slot])
+        if self.ct_team[b, y, x] < 0:
+            self.spawn_city_tile(b, team, x, y)
+        spent = 0
+        for k in range(3):
+            if spent + self.cargo[b, slot, k] > PARAMS['CITY_BUILD_COST']:
+                self.cargo[b, slot, k] -= PARAMS['CITY_BUILD_COST'] - spent
+                break
+            spent += self.cargo[b, slot, k]
+            self.cargo[b, slot, k] = 0
+
+    # Commands
+
+    def validate_command(self, b, team, command, placed, built, tiles):
+        """Parse a command into an action tuple, or None if the engine would reject it."""
+        name, *args = command.split(' ')
+        slots = self.unit_slots[b][team]
+        if name in ('p', 'bcity'):
+            slot = slots.get(args[0]) if len(args) == 1 else None
+            if slot is None or self.unit_cooldown[b, slot] >= 1 or slot in placed[team]:
+                return None
+            if name == 'bcity':
+                x, y = self.unit_x[b, slot], self.unit_y[b, slot]
+                has_resource = self.resource_type[b, y, x] >= 0 and self.resource_amount[b, y, x] > 0
+                if self.ct_team[b, y, x] >= 0 or has_resource or self.cargo[b, slot].sum() < PARAMS['CITY_BUILD_COST']:
+                    return None
+            placed[team].add(slot)
+            return name, slot
+        if name in ('bw', 'bc', 'r'):
+            if len(args) != 2:
+                return None
+            x, y = _parse_int(args[0]), _parse_int(args[1])
+            if x is None or y is None or not self._in_map(b, x, y) or self.ct_team[b, y, x] != team:
+                return None
+            if (x, y) in placed[team] or self.ct_cooldown[b, y, x] >= 1:
+                return None
+            if name != 'r':
+                if len(slots) + built[team] >= tiles[team]:
+                    return None
+                built[team] += 1
+            placed[team].add((x, y))
+            return name, team, x, y
+        if name == 'm':
+            slot = slots.get(args[0]) if len(args) == 2 else None
+            if slot is None or self.unit_cooldown[b, slot] >= 1 or slot in placed[team] or args[1] not in DIRECTIONS:
+                return None
+            dx, dy = DIRECTIONS[args[1]]
+            x, y = int(self.unit_x[b, slot]) + dx, int(self.unit_y[b, slot]) + dy
+            if not self._in_map(b, x, y) or self.ct_team[b, y, x] not in (-1, team):
+                return None
+            placed[team].add(slot)
+            return name, team, slot, args[1], (x, y)
+        if name == 't':
+            if len(args) != 4:
+                return None
+            src, dst, amount = slots.get(args[0]), slots.get(args[1]), _parse_int(args[3])
+            if src is None or dst is None or src == dst or self.unit_cooldown[b, src] >= 1 or src in placed[team]:
+                return None
+            distance = abs(self.unit_x[b, src] - self.unit_x[b, dst]) + abs(self.unit_y[b, src] - self.unit_y[b, dst])
+            if distance > 1 or amount is None or amount < 0 or args[2] not in RESOURCE_IDS:
+                return None
+            placed[team].add(src)
+            return name, src, dst, RESOURCE_IDS[args[2]], amount
+        return None
+
+    def plan(self, b, commands) -> MatchPlan:
+        plan = MatchPlan()
+        placed, built = [set(), set()], [0, 0]
+        tiles = [int((self.ct_team[b] == team).sum()) for team in (0, 1)]
+        for team, team_commands in enumerate(commands):
+            for command in team_commands or []:
+                if command.split(' ')[0][:1] == 'd':
+                    continue
+                action = self.validate_command(b, team, command, placed, built, tiles)
+                if action is None:
+                    self.warnings[b].append(f'turn {self.turn[b]}; team {team}; invalid command: {command}')
+                elif action[0] == 'm':
+                    plan.moves.append(action[1:])
+                elif action[0] in ('bw', 'bc', 'r'):
+                    plan.tile_actions.append(action)
+                else:
+                    plan.unit_actions[action[1]] = action
+        plan.moves = self.resolve_moves(b, plan.moves)
+        return plan
+
+    def resolve_moves(self, b, moves):
+        """Cancel colliding moves, and recursively any moves into the cells of cancelled units."""
+        occupants = {}
+        for slot in np.flatnonzero(self.unit_alive[b]).tolist():
+            occupants.setdefault((int(self.unit_x[b, slot]), int(self.unit_y[b, slot])), []).append(slot)
+        by_cell = {}
+        for move in moves:
+            by_cell.setdefault(move[3], []).append(move)
+        moving = {move[1] for move in moves}
+
+        def cancel(move):
+            cell = (int(self.unit_x[b, move[1]]), int(self.unit_y[b, move[1]]))
+            incoming = by_cell.get(cell)
+            if self.ct_team[b, cell[1], cell[0]] < 0:
+                by_cell.pop(cell, None)
+                for other in incoming or []:
+                    cancel(other)
+
+        for cell in list(by_cell):
+            group = by_cell.get(cell)
+            cancelled = []
+            if group is not None and self.ct_team[b, cell[1], cell[0]] < 0:
+                if len(group) > 1:
+                    cancelled.extend(group)
+                else:
+                    units = occupants.get(cell, [])
+                    if len(units) == 1 and units[0] not in moving:
+                        cancelled.append(group[0])
+            for move in cancelled:
+                cancel(move)
+            for move in cancelled:
+                by_cell.pop(move[3], None)
+        return [move for group in by_cell.values() for move in group if move[2] != 'c']
+
+    # Turn phases, each over the whole batch
+
+    def citytile_turns(self, plans, active):
+        acted = np.zeros_like(self.ct_team, bool)
+        for b, plan in enumerate(plans):
+            if plan is None:
+                continue
+            spawns = []
+            for name, team, x, y in plan.tile_actions:
+                acted[b, y, x] = True
+                if name == 'r':
+                    self.research[b, team] += 1
+                else:
+                    spawns.append((self.ct_city[b, y, x], self.ct_order[b, y, x], name, team, x, y))
+            for *_, name, team, x, y in sorted(spawns):
+                self.spawn_unit(b, WORKER if name == 'bw' else CART, team, x, y)
+        self.researched[:, :, 1] |= self.research >= PARAMS['RESEARCH_REQUIREMENTS']['COAL']
+        self.researched[:, :, 2] |= self.research >= PARAMS['RESEARCH_REQUIREMENTS']['URANIUM']
+        self.ct_cooldown[acted] = PARAMS['CITY_ACTION_COOLDOWN']
+        ticking = (self.ct_team >= 0) & (self.ct_cooldown > 0) & active[:, None, None]
+        self.ct_cooldown[ticking] -= 1
+
+    def unit_turns(self, plans, active):
+        acted = np.zeros_like(self.unit_alive)
+        move_b, move_slot, move_dx, move_dy = [], [], [], []
+        pillages = {}
+        for b, plan in enumerate(plans):
+            if plan is None:
+                continue
+            for slot in sorted(plan.unit_actions, key=lambda s: (self.unit_team[b, s], s)):
+                action = plan.unit_actions[slot]
+                if action[0] == 't':
+                    self.transfer(b, *action[1:])
+                elif self.unit_type[b, slot] != WORKER:
+                    continue
+                elif action[0] == 'bcity':
+                    self.build_city(b, slot)
+                else:
+                    cell = (b, int(self.unit_y[b, slot]), int(self.unit_x[b, slot]))
+                    pillages.setdefault(cell, []).append((self.unit_team[b, slot], slot))
+                acted[b, slot] = True
+            for team, slot, direction, _ in plan.moves:
+                move_b.append(b)
+                move_slot.append(slot)
+                move_dx.append(DIRECTIONS[direction][0])
+                move_dy.append(DIRECTIONS[direction][1])
+                acted[b, slot] = True
+        if move_b:
+            self.unit_x[move_b, move_slot] += move_dx
+            self.unit_y[move_b, move_slot] += move_dy
+        multiplier = np.where(self.is_night(), 2, 1)[:, None]
+        self.unit_cooldown += acted * UNIT_COOLDOWN[self.unit_type] * multiplier
+
+        # Roads: carts develop their cell after moving, pillaging workers wear theirs down
+        carts = self.unit_alive & (self.unit_type == CART) & active[:, None]
+        cb, cs = np.nonzero(carts)
+        cart_count = np.zeros(self.road.shape, np.int64)
+        np.add.at(cart_count, (cb, self.unit_y[cb, cs], self.unit_x[cb, cs]), 1)
+        for (b, y, x), pillagers in pillages.items():
+            if cart_count[b, y, x] == 0:
+                self.road[b, y, x] = max(self.road[b, y, x] - PARAMS['PILLAGE_RATE'] * len(pillagers), PARAMS['MIN_ROAD'])
+                continue
+            # Both on one cell - apply in unit order, as the clamps do not commute
+            here = (cb == b) & (self.unit_y[cb, cs] == y) & (self.unit_x[cb, cs] == x)
+            events = [((t, s), True) for t, s in pillagers] + [((self.unit_team[b, s], s), False) for s in cs[here]]
+            for _, is_pillage in sorted(events):
+                if is_pillage:
+                    self.road[b, y, x] = max(self.road[b, y, x] - PARAMS['PILLAGE_RATE'], PARAMS['MIN_ROAD'])
+                elif self.ct_team[b, y, x] < 0:
+                    self.road[b, y, x] = min(self.road[b, y, x] + PARAMS['CART_ROAD_DEVELOPMENT_RATE'], PARAMS['MAX_ROAD'])
+            cart_count[b, y, x] = 0
+        developing = (cart_count > 0) & (self.ct_team < 0)
+        self.road[developing] = np.minimum(
+            self.road[developing] + PARAMS['CART_ROAD_DEVELOPMENT_RATE'] * cart_count[developing], PARAMS['MAX_ROAD'])
+
+    def distribute_resources(self, k, active):
+        """Workers collect resource `k` from their own and adjacent cells, sharing each cell's amount evenly."""
+        workers = self.unit_alive & (self.unit_type == WORKER) & active[:, None]
+        wb, ws = np.nonzero(workers)
+        keep = self.researched[wb, self.unit_team[wb, ws], k]
+        wb, ws = wb[keep], ws[keep]
+        if len(wb) == 0:
+            return
+        x, y = self.unit_x[wb, ws], self.unit_y[wb, ws]
+        sx, sy = x[:, None] + OFFSETS[:, 0], y[:, None] + OFFSETS[:, 1]
+        in_map = (sx >= 0) & (sy >= 0) & (sx < self.width[wb, None]) & (sy < self.height[wb, None])
+        size = self.road.shape[1]
+        sxc, syc = np.clip(sx, 0, size - 1), np.clip(sy, 0, size - 1)
+        bb = np.broadcast_to(wb[:, None], sx.shape)
+        is_source = in_map & (self.resource_type[bb, syc, sxc] == k) & (self.resource_amount[bb, syc, sxc] > 0)
+        sources = is_source.sum(1)
+        space = CAPACITY[WORKER] - self.cargo[wb, ws].sum(1)
+        amount = np.minimum(-(-space // np.maximum(sources, 1)), COLLECTION_RATE[k])
+        on_citytile = self.ct_team[wb, y, x] >= 0
+        requester = np.where(on_citytile, -1, ws)
+        w, j = np.nonzero(is_source)
+        if len(w) == 0:
+            return
+        # Workers standing on a citytile request for the city, so identical requests from one citytile merge
+        keys = np.stack([wb[w], syc[w, j], sxc[w, j], y[w], x[w], amount[w], requester[w], w], axis=1)
+        _, first = np.unique(keys[:, :7], axis=0, return_index=True)
+        keys = keys[np.sort(first)]
+        keys = keys[np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))]
+        cell = (keys[:, 0] * size + keys[:, 1]) * size + keys[:, 2]
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        group = np.cumsum(np.r_[True, cell[1:] != cell[:-1]]) - 1
+        gb, gy, gx = keys[starts, 0], keys[starts, 1], keys[starts, 2]
+        available = self.resource_amount[gb, gy, gx].copy()
+        remaining = keys[:, 5].copy()
+        pending = np.ones(len(keys), bool)
+        received = np.zeros(len(keys), np.int64)
+        while True:
+            count = np.add.reduceat(pending.astype(np.int64), starts)
+            total = np.add.reduceat(np.where(pending, remaining, 0), starts)
+            running = (count > 0) & (total > 0) & (available > 0)
+            if not running.any():
+                break
+            smallest = np.minimum.reduceat(np.where(pending, remaining, np.iinfo(np.int64).max), starts)
+            share = np.where(running, np.minimum(smallest, available // np.maximum(count, 1)), 0)
+            given = share[group] * pending
+            received += given
+            remaining -= given
+            available = np.where(running, available - share * count, available)
+            available = np.where(running & (available < count), 0, available)
+            pending &= (remaining > 0) | ~running[group]
+        self.resource_amount[gb, gy, gx] = available
+
+        for_city = keys[:, 6] < 0
+        city_b = keys[for_city, 0]
+        np.add.at(self.city_fuel, (city_b, self.ct_city[city_b, keys[for_city, 3], keys[for_city, 4]]),
+                  received[for_city] * FUEL_RATE[k])
+        gained = np.zeros(len(wb), np.int64)
+        np.add.at(gained, keys[~for_city, 7], received[~for_city])
+        self.cargo[wb, ws, k] += np.minimum(space, gained)
+
+    def deposit(self, active):
+        ub, us = np.nonzero(self.unit_alive & active[:, None])
+        y, x = self.unit_y[ub, us], self.unit_x[ub, us]
+        home = self.ct_team[ub, y, x] == self.unit_team[ub, us]
+        ub, us, y, x = ub[home], us[home], y[home], x[home]
+        np.add.at(self.city_fuel, (ub, self.ct_city[ub, y, x]), self.cargo[ub, us] @ FUEL_RATE)
+        self.cargo[ub, us] = 0
+
+    def handle_night(self, night):
+        tb, ty, tx = np.nonzero((self.ct_team >= 0) & night[:, None, None])
+        upkeep = np.zeros_like(self.city_fuel)
+        np.add.at(upkeep, (tb, self.ct_city[tb, ty, tx]),
+                  PARAMS['LIGHT_UPKEEP']['CITY'] - self.ct_adjacent[tb, ty, tx] * PARAMS['CITY_ADJACENCY_BONUS'])
+        lit = self.city_alive & night[:, None]
+        destroyed = lit & (self.city_fuel < upkeep)
+        self.city_fuel = np.where(lit & ~destroyed, self.city_fuel - upkeep, self.city_fuel)
+        self.city_alive &= ~destroyed
+        dark = (self.ct_team >= 0) & np.take_along_axis(destroyed, np.maximum(self.ct_city, 0).reshape(self.size, -1),
+                                                        1).reshape(self.ct_city.shape)
+        self.ct_team[dark] = -1
+        self.ct_city[dark] = -1
+        self.ct_cooldown[dark] = 0
+        self.ct_adjacent[dark] = 0
+        self.road[dark] = PARAMS['MIN_ROAD']
+
+        ub, us = np.nonzero(self.unit_alive & night[:, None])
+        outside = self.ct_team[ub, self.unit_y[ub, us], self.unit_x[ub, us]] < 0
+        ub, us = ub[outside], us[outside]
+        needed = UNIT_UPKEEP[self.unit_type[ub, us]]
+        for k in range(3):
+            used = np.where(needed > 0, np.minimum(self.cargo[ub, us, k], -(-needed // FUEL_RATE[k])), 0)
+            needed = needed - used * FUEL_RATE[k]
+            self.cargo[ub, us, k] -= used
+        dead = needed > 0
+        for b, slot in zip(ub[dead].tolist(), us[dead].tolist()):
+            del self.unit_slots[b][self.unit_team[b, slot]][f'u_{self.unit_id[b, slot]}']
+        self.unit_alive[ub[dead], us[dead]] = False
+
+    def regrow_trees(self, active):
+        growing = ((self.resource_type == 0) & (self.resource_amount > 0) &
+                   (self.resource_amount < PARAMS['MAX_WOOD_AMOUNT']) & active[:, None, None])
+        self.resource_amount[growing] = np.ceil(np.minimum(
+            self.resource_amount[growing] * PARAMS['WOOD_GROWTH_RATE'], PARAMS['MAX_WOOD_AMOUNT'])).astype(np.int64)
+
+    def team_counts(self):
+        """Units, cities and citytiles per team, each [batch, 2]."""
+        units = np.stack([(self.unit_alive & (self.unit_team == t)).sum(1) for t in (0, 1)], 1)
+        cities = np.stack([(self.city_alive & (self.city_team == t)).sum(1) for t in (0, 1)], 1)
+        tiles = np.stack([(self.ct_team == t).sum((1, 2)) for t in (0, 1)], 1)
+        return units, cities, tiles
+
+    def step(self, actions: Sequence[Tuple[Optional[List[str]], Optional[List[str]]]]):
+        """Apply each match's pair of command lists. Finished matches are left unchanged."""
+        active = ~self.done
+        plans = [self.plan(b, actions[b]) if active[b] else None for b in range(self.size)]
+        self.citytile_turns(plans, active)
+        self.unit_turns(plans, active)
+        for k in (2, 1, 0):
+            self.distribute_resources(k, active)
+        self.deposit(active)
+        night = active & self.is_night()
+        if night.any():
+            self.handle_night(night)
+        self.regrow_trees(active)
+        units, cities, _ = self.team_counts()
+        over = active & ((self.turn == PARAMS['MAX_DAYS'] - 1) | (units + cities == 0).any(1))
+        self.turn[active] += 1
+        self.done |= over
+        ub, us = np.nonzero(self.unit_alive & active[:, None])
+        y, x = self.unit_y[ub, us], self.unit_x[ub, us]
+        road = np.where(self.ct_team[ub, y, x] >= 0, PARAMS['MAX_ROAD'], self.road[ub, y, x])
+        self.unit_cooldown[ub, us] = np.maximum(self.unit_cooldown[ub, us] - road - 1, 0)
+
+    # Observations
+
+    def get_updates(self, b) -> List[str]:
+        """The engines game information lines for match `b`, in its order."""
+        w, h = self.width[b], self.height[b]
+        lines = [f'rp {team} {self.research[b, team]}' for team in (0, 1)]
+        amounts, types = self.resource_amount[b, :h, :w], self.resource_type[b, :h, :w]
+        xs, ys = np.nonzero(amounts.T > 0)
+        lines += [f'r {RESOURCE_ORDER[types[y, x]]} {x} {y} {amounts[y, x]}' for x, y in zip(xs.tolist(), ys.tolist())]
+        slots = np.flatnonzero(self.unit_alive[b])
+        for slot in slots[np.argsort(self.unit_team[b, slots], kind='stable')].tolist():
+            cargo = self.cargo[b, slot]
+            lines.append(f'u {self.unit_type[b, slot]} {self.unit_team[b, slot]} u_{self.unit_id[b, slot]} '
+                         f'{self.unit_x[b, slot]} {self.unit_y[b, slot]} {_fmt(float(self.unit_cooldown[b, slot]))} '
+                         f'{cargo[0]} {cargo[1]} {cargo[2]}')
+        ty, tx = np.nonzero(self.ct_team[b] >= 0)
+        tile_city, tile_order = self.ct_city[b, ty, tx], self.ct_order[b, ty, tx]
+        upkeep = np.zeros(self.city_fuel.shape[1], np.int64)
+        np.add.at(upkeep, tile_city,
+                  PARAMS['LIGHT_UPKEEP']['CITY'] - self.ct_adjacent[b, ty, tx] * PARAMS['CITY_ADJACENCY_BONUS'])
+        cities = np.flatnonzero(self.city_alive[b]).tolist()
+        lines += [f'c {self.city_team[b, c]} c_{self.city_id[b, c]} {self.city_fuel[b, c]} {upkeep[c]}' for c in cities]
+        for i in np.lexsort((tile_order, tile_city)).tolist():
+            y, x = ty[i], tx[i]
+            lines.append(f'ct {self.ct_team[b, y, x]} c_{self.city_id[b, tile_city[i]]} {x} {y} '
+                         f'{_fmt(float(self.ct_cooldown[b, y, x]))}')
+        road = np.where(self.ct_team[b, :h, :w] >= 0, PARAMS['MAX_ROAD'], self.road[b, :h, :w])
+        ys, xs = np.nonzero(road != 0)
+        lines += [f'ccd {x} {y} {_fmt(float(road[y, x]))}' for y, x in zip(ys.tolist(), xs.tolist())]
+        if self.turn[b] == 0:
+            lines = ['0', f'{w} {h}'] + lines
+        return lines + ['D_DONE']
+
+    def rewards(self) -> np.ndarray:
+        """Kaggle rewards per match and team - citytiles, then units as the tie break."""
+        units, _, tiles = self.team_counts()
+        return tiles * 10000 + units
+
+    def observation(self, b, player: int, remaining_overage_time=60) -> Observation:
+        return Observation({
+            'remainingOverageTime': remaining_overage_time,
+            'step': int(self.turn[b]),
+            'width': int(self.width[b]),
+            'height': int(self.height[b]),
+            'reward': int(self.rewards()[b, player]),
+            'globalUnitIDCount': int(self.unit_id_count[b]),
+            'globalCityIDCount': int(self.city_id_count[b]),
+            'player': player,
+            'updates': self.get_updates(b),
+        })
+
+
+def run_batch(agent_factories: Sequence[Callable[[], Callable]], seeds: Sequence[int],
+              config: Optional[dict] = None) -> BatchSim:
+    """
+    Play one match per seed, with a fresh pair of agents per match from `agent_factories`.
+
+    Agent functions keeping module level state can only play one match per process at a time. For luxbot, pass
+    factories returning the bound `act` of a new LuxBot, e.g. `lambda: LuxBot().act`.
+    """
+    batch = BatchSim(seeds)
+    configs = [Observation({**DEFAULT_CONFIG, 'seed': seed, **(config or {})}) for seed in seeds]
+    agents = [[factory() for factory in agent_factories] for _ in seeds]
+    while not batch.done.all():
+        actions = []
+        for b in range(batch.size):
+            if batch.done[b]:
+                actions.append(([], []))
+            else:
+                actions.append(tuple(agent(batch.observation(b, player), configs[b])
+                                     for player, agent in enumerate(agents[b])))
+        batch.step(actions)
+    return batch
@@ -0,0 +1,157 @@
+"""
+Warm bot hosting - each bot version runs in its own long lived worker process (utils/bot_worker.py).
+
+A worker imports its bot once, with the bot directory as its import root, so versions never share `agent`, `lux` or
+`tools` modules and a tournament pays interpreter startup and import cost once per worker rather than once per game.
+Bots reset their state on the step 0 observation, so a worker plays any number of games back to back. A worker that
+misses a deadline is killed, as Kaggle does with an agent over its time.
+"""
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+WORKER_SCRIPT = Path(__file__).parent / 'bot_worker.py'
+STARTUP_TIMEOUT = 60  # Seconds to import the bot
+
+
+class BotError(Exception):
+    """The hosted bot raised, or its worker process died. `traceback` holds the bot's own traceback, if any."""
+
+    def __init__(self, message: str, traceback: str = ''):
+        super().__init__(message)
+        self.traceback = traceback
+
+
+class BotTimeout(BotError):
+    """The hosted bot missed its deadline, and its worker was killed."""
+
+
+def turn_limit(obs, config) -> Optional[float]:
+    """Kaggle's limit on one call: actTimeout plus the agent's remaining overage. None if unlimited."""
+    if config is None or not config.get('actTimeout'):
+        return None
+    return config['actTimeout'] + obs.get('remainingOverageTime', 0)
+
+
+class BotWorker:
+    """Client for one worker process. Callable like an agent function: worker(obs, config) -> actions."""
+
+    def __init__(self, name: str, path, stderr=subprocess.DEVNULL):
+        self.name = name
+        self.path = Path(path)
+        self.process = subprocess.Popen([sys.executable, str(WORKER_SCRIPT), str(self.path)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+        self.last_elapsed = 0.
+        self.replies = queue.Queue()
+        threading.Thread(target=self._read_replies, daemon=True).start()
+        try:
+            self._receive(STARTUP_TIMEOUT)
+        except BotError:
+            self.close()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_replies(self):
+        """Queue each reply as it arrives, then None once the worker exits. A thread rather than select on the pipe,
+        so deadlines hold on Windows too."""
+        try:
+            while True:
+                self.replies.put(pickle.load(self.process.stdout))
+        except (EOFError, OSError, ValueError, pickle.UnpicklingError):
+            self.replies.put(None)
+
+    def _receive(self, timeout: Optional[float]):
+        try:
+            reply = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            self.process.kill()
+            self.process.wait()
+            raise BotTimeout(f'{self.name} timed out after {timeout:.1f}s')
+        if reply is None:
+            raise BotError(f'{self.name} worker exited with code {self.process.wait()}')
+        status, payload, self.last_elapsed = reply
+        if status == 'error':
+            raise BotError(payload.strip().splitlines()[-1], payload)
+        return payload
+
+    def __call__(self, obs, config=None, timeout: Optional[float] = None) -> List[str]:
+        """Actions for obs. The deadline defaults to turn_limit(obs, config); missing it raises BotTimeout."""
+        try:
+            pickle.dump(('act', dict(obs), None if config is None else dict(config)), self.process.stdin)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise BotError(f'{self.name} worker exited with code {self.process.wait()}')
+        return self._receive(turn_limit(obs, config) if timeout is None else timeout)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:  # Exited with a request unread
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BotPool:
+    """Idle warm workers per bot name. Checking out a busy name (e.g. self play) starts another worker."""
+
+    def __init__(self, paths: Dict[str, str], stderr=subprocess.DEVNULL):
+        self.paths = paths
+        self.stderr = stderr
+        self.idle: Dict[str, List[BotWorker]] = defaultdict(list)
+
+    def checkout(self, name: str) -> BotWorker:
+        while self.idle[name]:
+            worker = self.idle[name].pop()
+            if worker.alive:
+                return worker
+            worker.close()
+        return BotWorker(name, self.paths[name], self.stderr)
+
+    def checkin(self, worker: BotWorker):
+        if worker.alive:
+            self.idle[worker.name].append(worker)
+        else:
+            worker.close()
+
+    def close(self):
+        for workers in self.idle.values():
+            for worker in workers:
+                worker.close()
+        self.idle.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_pool: Optional[BotPool] = None
+
+
+def shared_pool(paths: Dict[str, str]) -> BotPool:
+    """This process's pool, kept across calls so tournament worker processes reuse warm bots between games."""
+    global _pool
+    if _pool is None:
+        _pool = BotPool(paths)
+    _pool.paths.update(paths)
+    return _pool
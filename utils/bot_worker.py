@@ -0,0 +1,59 @@
+"""
+Worker process hosting one bot version - started by utils.bot_host, not imported.
+
+    python utils/bot_worker.py path/to/bot
+
+The bot directory replaces this script's directory at the front of sys.path, so the bot's top level `agent`, `lux`
+and `tools` modules are the only ones importable by those names. Requests and replies are pickled over stdin and
+the original stdout, while anything the bot prints goes to stderr.
+"""
+import os
+import pickle
+import sys
+import time
+import traceback
+
+
+class Observation(dict):
+    """Dict with attribute access, standing in for the structs kaggle_environments hands to agents."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def main(bot_path):
+    requests = sys.stdin.buffer
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.path[0] = bot_path
+    try:
+        from agent import agent
+    except Exception:
+        pickle.dump(('error', traceback.format_exc(), 0.), replies)
+        replies.flush()
+        return
+
+    pickle.dump(('ready', None, 0.), replies)
+    replies.flush()
+    while True:
+        try:
+            kind, obs, config = pickle.load(requests)
+        except EOFError:
+            return
+        if kind != 'act':
+            continue
+        t0 = time.perf_counter()
+        try:
+            actions = agent(Observation(obs), None if config is None else Observation(config))
+            reply = ('ok', actions, time.perf_counter() - t0)
+        except Exception:
+            reply = ('error', traceback.format_exc(), time.perf_counter() - t0)
+        pickle.dump(reply, replies)
+        replies.flush()
+
+
+if __name__ == '__main__':
+    main(os.path.abspath(sys.argv[1]))
@@ -0,0 +1,835 @@
+"""Headless forward model of the Lux AI 2021 engine.
+
+A pure Python port of the rules in the kaggle_environments `lux_ai_2021` dimensions engine (v3.1.0), so matches can
+be stepped locally without node or kaggle_environments. Maps are generated from the same seeds, both players
+commands are applied with the engines validation, ordering and tie breaks, and observations are emitted as the
+`updates` text lines that `lux.game.Game` parses.
+"""
+import json
+import math
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+pathroot = Path(__file__).parents[1]
+with open(pathroot / 'luxbot' / 'lux' / 'game_constants.json') as f:
+    PARAMS = json.load(f)['PARAMETERS']
+
+WORKER, CART = 0, 1
+RESOURCE_ORDER = ['wood', 'coal', 'uranium']
+DISTRIBUTION_ORDER = ['uranium', 'coal', 'wood']
+DIRECTIONS = {'n': (0, -1), 'e': (1, 0), 's': (0, 1), 'w': (-1, 0), 'c': (0, 0)}
+MAP_SIZES = [12, 16, 24, 32]
+HORIZONTAL, VERTICAL = 0, 1
+# Neighbour offsets used by map generation, in the engines order
+NEIGHBOURS = [(0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1)]
+DEFAULT_CONFIG = {'episodeSteps': 361, 'actTimeout': 3, 'runTimeout': 1200}
+
+
+class InvalidCommand(Exception):
+    pass
+
+
+class Observation(dict):
+    """Dict with attribute access, standing in for the structs kaggle_environments hands to agents."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class SeedRandom:
+    """Port of the ARC4 based `seedrandom` generator the engine seeds map generation with."""
+
+    def __init__(self, seed):
+        key = []
+        smear = 0
+        for i, char in enumerate(str(seed)):
+            k = i & 255
+            if k < len(key):
+                smear ^= key[k] * 19
+                key[k] = (smear + ord(char)) & 255
+            else:
+                key.append((smear + ord(char)) & 255)
+        if not key:
+            key = [0]
+        self.i = self.j = 0
+        s = self.s = list(range(256))
+        j = 0
+        for i in range(256):
+            t = s[i]
+            j = (j + key[i % len(key)] + t) & 255
+            s[i] = s[j]
+            s[j] = t
+        self.bytes(256)
+
+    def bytes(self, count):
+        """Next `count` keystream bytes as a big endian integer."""
+        r, i, j, s = 0, self.i, self.j, self.s
+        for _ in range(count):
+            i = (i + 1) & 255
+            t = s[i]
+            j = (j + t) & 255
+            s[i] = s[j]
+            s[j] = t
+            r = r * 256 + s[(s[i] + t) & 255]
+        self.i, self.j = i, j
+        return r
+
+    def __call__(self) -> float:
+        n, d, x = float(self.bytes(6)), 256.0 ** 6, 0
+        while n < 2 ** 52:
+            n = (n + x) * 256
+            d *= 256
+            x = self.bytes(1)
+        while n >= 2 ** 53:
+            n /= 2
+            d /= 2
+            x >>= 1
+        return (n + x) / d
+
+
+def _sign(v):
+    return (v > 0) - (v < 0)
+
+
+def _parse_int(s):
+    """parseInt semantics - leading integer or None."""
+    m = re.match(r'\s*([+-]?\d+)', s)
+    return int(m.group(1)) if m else None
+
+
+def _fmt(v):
+    """Format a number as the engine (javascript) would."""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _cellular_layer(rng, base, spread, cols, rows, death_limit, birth_limit):
+    chance = base - spread / 2 + spread * rng()
+    grid = [[1 if rng() < chance else 0 for _ in range(cols)] for _ in range(rows)]
+    for _ in range(2):
+        for y in range(1, rows - 1):
+            for x in range(1, cols - 1):
+                n = sum(grid[y + dy][x + dx] == 1 for dx, dy in NEIGHBOURS)
+                if grid[y][x] == 1:
+                    grid[y][x] = 0 if n < death_limit else 1
+                else:
+                    grid[y][x] = 1 if n > birth_limit else 0
+    return grid
+
+
+def _resource_amount(rng, rtype):
+    if rtype == 'wood':
+        return min(300 + math.floor(100 * rng()), 500)
+    if rtype == 'coal':
+        return 350 + math.floor(75 * rng())
+    return 300 + math.floor(50 * rng())
+
+
+def _gravity_force(grid, x, y):
+    force = [0, 0]
+    rtype = grid[y][x][0]
+    for oy in range(y - 5, y + 5):
+        for ox in range(x - 5, x + 5):
+            if ox < 0 or oy < 0 or ox >= len(grid[0]) or oy >= len(grid):
+                continue
+            other = grid[oy][ox]
+            if other is not None:
+                dx, dy = x - ox, y - oy
+                dist = abs(dx) + abs(dy)
+                sign = 1 if other[0] != rtype else -1
+                if dx != 0:
+                    force[0] += sign * (dx / dist) ** 2 * _sign(dx)
+                if dy != 0:
+                    force[1] += sign * (dy / dist) ** 2 * _sign(dy)
+    return force
+
+
+def _gravitate(grid):
+    """One pass of pulling like resources together and pushing unlike ones apart."""
+    rows, cols = len(grid), len(grid[0])
+    forces = {(x, y): _gravity_force(grid, x, y) for y in range(rows) for x in range(cols) if grid[y][x] is not None}
+    moved = [[None] * cols for _ in range(rows)]
+    for y in range(rows):
+        for x in range(cols):
+            resource = grid[y][x]
+            if resource is not None:
+                fx, fy = forces[(x, y)]
+                nx = min(max(x + _sign(fx), 0), cols - 1)
+                ny = min(max(y + _sign(fy), 0), rows - 1)
+                if moved[ny][nx] is None:
+                    moved[ny][nx] = resource
+                else:
+                    moved[y][x] = resource
+    return moved
+
+
+def _resource_grid(rng, symmetry, width, height, half_width, half_height):
+    grid = [[None] * width for _ in range(height)]
+    layers = [('wood', .21, .01, 2, 4), ('coal', .11, .02, 2, 4), ('uranium', .055, .04, 1, 6)]
+    for rtype, base, spread, death_limit, birth_limit in layers:
+        layer = _cellular_layer(rng, base, spread, half_width, half_height, death_limit, birth_limit)
+        for y, row in enumerate(layer):
+            for x, v in enumerate(row):
+                if v == 1:
+                    grid[y][x] = [rtype, _resource_amount(rng, rtype)]
+    for _ in range(10):
+        grid = _gravitate(grid)
+    for y in range(half_height):
+        for x in range(half_width):
+            resource = grid[y][x]
+            if resource is not None:
+                for dx, dy in NEIGHBOURS:
+                    nx, ny = x + dx, y + dy
+                    # The engine bounds x by the half height and y by the half width
+                    if not (nx < 0 or ny < 0 or nx >= half_height or ny >= half_width) and rng() < .05:
+                        amount = 300 + math.floor(50 * rng())
+                        if resource[0] == 'coal':
+                            amount = 350 + math.floor(75 * rng())
+                        if resource[0] == 'wood':
+                            amount = min(300 + math.floor(100 * rng()), 500)
+                        grid[ny][nx] = [resource[0], amount]
+    for y in range(half_height):
+        for x in range(half_width):
+            if symmetry == VERTICAL:
+                grid[y][width - x - 1] = grid[y][x]
+            else:
+                grid[height - y - 1][x] = grid[y][x]
+    return grid
+
+
+def _enough_resources(grid):
+    totals = {'wood': 0, 'coal': 0, 'uranium': 0}
+    for row in grid:
+        for resource in row:
+            if resource is not None:
+                totals[resource[0]] += resource[1]
+    return totals['wood'] >= 2000 and totals['coal'] >= 1500 and totals['uranium'] >= 300
+
+
+class SimCell:
+    __slots__ = ('x', 'y', 'resource_type', 'resource_amount', 'citytile', 'units', 'road')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.resource_type: Optional[str] = None
+        self.resource_amount = 0
+        self.citytile: Optional[SimCityTile] = None
+        self.units: Dict[str, SimUnit] = {}
+        self.road = PARAMS['MIN_ROAD']
+
+    def has_resource(self):
+        return self.resource_type is not None and self.resource_amount > 0
+
+    def get_road(self):
+        return PARAMS['MAX_ROAD'] if self.citytile is not None else self.road
+
+
+class SimUnit:
+    __slots__ = ('type', 'team', 'id', 'x', 'y', 'cooldown', 'cargo', 'actions')
+
+    def __init__(self, unit_type, team, unit_id, x, y, cooldown=0, wood=0, coal=0, uranium=0):
+        self.type = unit_type
+        self.team = team
+        self.id = unit_id
+        self.x = x
+        self.y = y
+        self.cooldown = cooldown
+        self.cargo = {'wood': wood, 'coal': coal, 'uranium': uranium}
+        self.actions = []
+
+    @property
+    def capacity(self):
+        return PARAMS['RESOURCE_CAPACITY']['WORKER' if self.type == WORKER else 'CART']
+
+    def space_left(self):
+        return self.capacity - self.cargo['wood'] - self.cargo['coal'] - self.cargo['uranium']
+
+    def spend_fuel_to_survive(self):
+        upkeep = PARAMS['LIGHT_UPKEEP']['WORKER' if self.type == WORKER else 'CART']
+        for rtype in RESOURCE_ORDER:
+            rate = PARAMS['RESOURCE_TO_FUEL_RATE'][rtype.upper()]
+            used = min(self.cargo[rtype], math.ceil(upkeep / rate))
+            upkeep -= used * rate
+            self.cargo[rtype] -= used
+            if upkeep <= 0:
+                return True
+        return False
+
+
+class SimCityTile:
+    __slots__ = ('team', 'city_id', 'x', 'y', 'cooldown', 'adjacent', 'actions')
+
+    def __init__(self, team, city_id, x, y, cooldown=0):
+        self.team = team
+        self.city_id = city_id
+        self.x = x
+        self.y = y
+        self.cooldown = cooldown
+        self.adjacent = 0
+        self.actions = []
+
+    @property
+    def tile_id(self):
+        return f'{self.city_id}_{self.x}_{self.y}'
+
+
+class SimCity:
+    __slots__ = ('team', 'id', 'fuel', 'cells')
+
+    def __init__(self, team, city_id, fuel=0):
+        self.team = team
+        self.id = city_id
+        self.fuel = fuel
+        self.cells: List[SimCell] = []
+
+    def get_light_upkeep(self):
+        return sum(PARAMS['LIGHT_UPKEEP']['CITY'] - c.citytile.adjacent * PARAMS['CITY_ADJACENCY_BONUS']
+                   for c in self.cells)
+
+
+class LuxSim:
+    """
+    Lux AI 2021 match state and rules.
+
+    Build from a seed (`LuxSim(seed)`) or from any observation (`LuxSim.from_observation(obs)`), then advance with
+    `step(actions_0, actions_1)`. `observation(player)` gives the obs an agent would receive for the current turn.
+    """
+
+    def __init__(self, seed: Optional[int] = None, width: Optional[int] = None, height: Optional[int] = None):
+        self.seed = seed
+        self.turn = 0
+        self.done = False
+        self.global_unit_id_count = 0
+        self.global_city_id_count = 0
+        self.research_points = [0, 0]
+        self.researched = [{'wood': True, 'coal': False, 'uranium': False} for _ in range(2)]
+        self.units: List[Dict[str, SimUnit]] = [{}, {}]
+        self.cities: Dict[str, SimCity] = {}
+        self.resources: List[SimCell] = []
+        self.warnings: List[str] = []
+        self.width = self.height = 0
+        self.cells: List[List[SimCell]] = []
+        if seed is not None:
+            self._generate(seed, width, height)
+        self.updates = self.get_updates()
+
+    def _set_size(self, width, height):
+        self.width, self.height = width, height
+        self.cells = [[SimCell(x, y) for x in range(width)] for y in range(height)]
+
+    def _generate(self, seed, width=None, height=None):
+        rng = SeedRandom(f'gen_{seed}')
+        size = MAP_SIZES[math.floor(rng() * len(MAP_SIZES))]
+        self._set_size(width or size, height or size)
+        width, height = self.width, self.height
+        symmetry, half_width, half_height = HORIZONTAL, width, height
+        if rng() < .5:
+            symmetry, half_width = VERTICAL, width // 2
+        else:
+            half_height = height // 2
+        grid = _resource_grid(rng, symmetry, width, height, half_width, half_height)
+        while not _enough_resources(grid):
+            grid = _resource_grid(rng, symmetry, width, height, half_width, half_height)
+        for y, row in enumerate(grid):
+            for x, resource in enumerate(row):
+                if resource is not None:
+                    self.add_resource(x, y, *resource)
+        x = math.floor(rng() * (half_width - 1)) + 1
+        y = math.floor(rng() * (half_height - 1)) + 1
+        while self.cells[y][x].has_resource():
+            x = math.floor(rng() * (half_width - 1)) + 1
+            y = math.floor(rng() * (half_height - 1)) + 1
+
+        def mirror(px, py):
+            return (px, height - py - 1) if symmetry == HORIZONTAL else (width - px - 1, py)
+
+        self.spawn_unit(WORKER, 0, x, y)
+        self.spawn_city_tile(0, x, y)
+        self.spawn_unit(WORKER, 1, *mirror(x, y))
+        self.spawn_city_tile(1, *mirror(x, y))
+        start = math.floor(rng() * len(NEIGHBOURS))
+        trees = 0
+        for k in range(7):
+            dx, dy = NEIGHBOURS[(start + k) % len(NEIGHBOURS)]
+            sx, sy = x + dx, y + dy
+            ox, oy = mirror(sx, sy)
+            if self.in_map(sx, sy) and self.in_map(ox, oy):
+                for px, py in ((sx, sy), (ox, oy)):
+                    cell = self.cells[py][px]
+                    if not cell.has_resource() and cell.citytile is None:
+                        trees += 1
+                        self.add_resource(px, py, 'wood', 800)
+                if trees == 6:
+                    break
+        size = max(width, height)
+        self.resources.sort(key=lambda c: c.x * size + c.y)
+
+    @classmethod
+    def from_observation(cls, obs) -> 'LuxSim':
+        """Rebuild the full match state from an observation's updates, e.g. to branch off a saved replay."""
+        sim = cls()
+        updates = obs['updates']
+        if obs['step'] == 0:
+            width, height = (int(v) for v in updates[1].split(' '))
+            updates = updates[2:]
+        else:
+            width, height = obs['width'], obs['height']
+        sim._set_size(width, height)
+        sim.turn = obs['step']
+        sim.global_unit_id_count = obs.get('globalUnitIDCount', 0)
+        sim.global_city_id_count = obs.get('globalCityIDCount', 0)
+        for update in updates:
+            strs = update.split(' ')
+            if strs[0] == 'rp':
+                team, points = int(strs[1]), int(strs[2])
+                sim.research_points[team] = points
+                sim.researched[team]['coal'] = points >= PARAMS['RESEARCH_REQUIREMENTS']['COAL']
+                sim.researched[team]['uranium'] = points >= PARAMS['RESEARCH_REQUIREMENTS']['URANIUM']
+            elif strs[0] == 'r':
+                sim.add_resource(int(strs[2]), int(strs[3]), strs[1], int(strs[4]))
+            elif strs[0] == 'u':
+                unit = SimUnit(int(strs[1]), int(strs[2]), strs[3], int(strs[4]), int(strs[5]), float(strs[6]),
+                               int(strs[7]), int(strs[8]), int(strs[9]))
+                sim.units[unit.team][unit.id] = unit
+                sim.cells[unit.y][unit.x].units[unit.id] = unit
+            elif strs[0] == 'c':
+                sim.cities[strs[2]] = SimCity(int(strs[1]), strs[2], int(strs[3]))
+            elif strs[0] == 'ct':
+                x, y = int(strs[3]), int(strs[4])
+                cell = sim.cells[y][x]
+                cell.citytile = SimCityTile(int(strs[1]), strs[2], x, y, float(strs[5]))
+                sim.cities[strs[2]].cells.append(cell)
+            elif strs[0] == 'ccd':
+                x, y = int(strs[1]), int(strs[2])
+                if sim.cells[y][x].citytile is None:
+                    sim.cells[y][x].road = float(strs[3])
+        for city in sim.cities.values():
+            for cell in city.cells:
+                cell.citytile.adjacent = sum(1 for c in sim.get_adjacent_cells(cell)
+                                             if c.citytile is not None and c.citytile.team == city.team)
+        sim.updates = sim.get_updates()
+        return sim
+
+    # Map helpers
+
+    def in_map(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get_adjacent_cells(self, cell):
+        adjacent = []
+        for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+            if self.in_map(cell.x + dx, cell.y + dy):
+                adjacent.append(self.cells[cell.y + dy][cell.x + dx])
+        return adjacent
+
+    def add_resource(self, x, y, rtype, amount):
+        cell = self.cells[y][x]
+        cell.resource_type, cell.resource_amount = rtype, amount
+        self.resources.append(cell)
+
+    def is_night(self):
+        return self.turn % (PARAMS['DAY_LENGTH'] + PARAMS['NIGHT_LENGTH']) >= PARAMS['DAY_LENGTH']
+
+    def citytile_count(self, team):
+        return sum(len(c.cells) for c in self.cities.values() if c.team == team)
+
+    # State changes
+
+    def spawn_unit(self, unit_type, team, x, y):
+        self.global_unit_id_count += 1
+        unit = SimUnit(unit_type, team, f'u_{self.global_unit_id_count}', x, y)
+        self.cells[y][x].units[unit.id] = unit
+        self.units[team][unit.id] = unit
+        return unit
+
+    def spawn_city_tile(self, team, x, y):
+        cell = self.cells[y][x]
+        adjacent = [c for c in self.get_adjacent_cells(cell) if c.citytile is not None and c.citytile.team == team]
+        if not adjacent:
+            self.global_city_id_count += 1
+            city = SimCity(team, f'c_{self.global_city_id_count}')
+            cell.citytile = SimCityTile(team, city.id, x, y)
+            city.cells.append(cell)
+            self.cities[city.id] = city
+            return cell.citytile
+        city_ids = list(dict.fromkeys(c.citytile.city_id for c in adjacent))
+        city = self.cities[city_ids[0]]
+        cell.citytile = SimCityTile(team, city.id, x, y)
+        cell.citytile.adjacent = len(adjacent)
+        for c in adjacent:
+            c.citytile.adjacent += 1
+        city.cells.append(cell)
+        for city_id in city_ids[1:]:
+            merged = self.cities.pop(city_id)
+            for c in merged.cells:
+                c.citytile.city_id = city.id
+                city.cells.append(c)
+            city.fuel += merged.fuel
+        return cell.citytile
+
+    def move_unit(self, unit, direction):
+        del self.cells[unit.y][unit.x].units[unit.id]
+        dx, dy = DIRECTIONS[direction]
+        unit.x, unit.y = unit.x + dx, unit.y + dy
+        self.cells[unit.y][unit.x].units[unit.id] = unit
+
+    def transfer(self, team, src_id, dst_id, rtype, amount):
+        src, dst = self.units[team][src_id], self.units[team][dst_id]
+        amount = min(amount, src.cargo[rtype], dst.space_left())
+        src.cargo[rtype] -= amount
+        dst.cargo[rtype] += amount
+
+    def destroy_city(self, city_id):
+        city = self.cities.pop(city_id)
+        for cell in city.cells:
+            cell.citytile = None
+            cell.road = PARAMS['MIN_ROAD']
+
+    def destroy_unit(self, unit):
+        del self.cells[unit.y][unit.x].units[unit.id]
+        del self.units[unit.team][unit.id]
+
+    # Commands
+
+    def validate_command(self, team, command, placed):
+        """Parse a command into an action tuple, raising InvalidCommand as the engine would reject it."""
+        name, *args = command.split(' ')
+        units = self.units[team]
+        if name in ('dc', 'dx', 'dl', 'dt', 'dst'):
+            return None
+        if name in ('p', 'bcity'):
+            if len(args) != 1:
+                raise InvalidCommand(command)
+            unit = units.get(args[0])
+            if unit is None or unit.cooldown >= 1 or unit.id in placed[team]:
+                raise InvalidCommand(command)
+            if name == 'bcity':
+                cell = self.cells[unit.y][unit.x]
+                if cell.citytile is not None or cell.has_resource() or sum(unit.cargo.values()) < PARAMS['CITY_BUILD_COST']:
+                    raise InvalidCommand(command)
+            placed[team].add(unit.id)
+            return name, team, unit.id
+        if name in ('bw', 'bc', 'r'):
+            if len(args) != 2:
+                raise InvalidCommand(command)
+            x, y = _parse_int(args[0]), _parse_int(args[1])
+            if x is None or y is None or not self.in_map(x, y):
+                raise InvalidCommand(command)
+            citytile = self.cells[y][x].citytile
+            if citytile is None or citytile.team != team or citytile.tile_id in placed[team] or citytile.cooldown >= 1:
+                raise InvalidCommand(command)
+            if name != 'r':
+                if len(units) + placed['built'][team] >= self.citytile_count(team):
+                    raise InvalidCommand(command)
+                placed['built'][team] += 1
+            placed[team].add(citytile.tile_id)
+            return name, team, x, y
+        if name == 'm':
+            if len(args) != 2:
+                raise InvalidCommand(command)
+            unit = units.get(args[0])
+            direction = args[1]
+            if unit is None or unit.cooldown >= 1 or unit.id in placed[team] or direction not in DIRECTIONS:
+                raise InvalidCommand(command)
+            dx, dy = DIRECTIONS[direction]
+            if not self.in_map(unit.x + dx, unit.y + dy):
+                raise InvalidCommand(command)
+            cell = self.cells[unit.y + dy][unit.x + dx]
+            if cell.citytile is not None and cell.citytile.team != team:
+                raise InvalidCommand(command)
+            placed[team].add(unit.id)
+            return name, team, unit.id, direction, cell
+        if name == 't':
+            if len(args) != 4:
+                raise InvalidCommand(command)
+            src, dst = units.get(args[0]), units.get(args[1])
+            amount = _parse_int(args[3])
+            if src is None or dst is None or src.cooldown >= 1 or src.id in placed[team] or src is dst:
+                raise InvalidCommand(command)
+            if abs(src.x - dst.x) + abs(src.y - dst.y) > 1 or amount is None or amount < 0 or args[2] not in RESOURCE_ORDER:
+                raise InvalidCommand(command)
+            placed[team].add(src.id)
+            return name, team, src.id, dst.id, args[2], amount
+        raise InvalidCommand(command)
+
+    def resolve_moves(self, moves):
+        """Cancel colliding moves, and recursively any moves into the cells of cancelled units."""
+        by_cell = {}
+        moving = set()
+        for move in moves:
+            by_cell.setdefault(move[4], []).append(move)
+            moving.add(move[2])
+
+        def cancel(move):
+            unit = self.units[move[1]][move[2]]
+            cell = self.cells[unit.y][unit.x]
+            incoming = by_cell.get(cell)
+            if cell.citytile is None:
+                by_cell.pop(cell, None)
+                for other in incoming or []:
+                    cancel(other)
+
+        for cell in list(by_cell):
+            group = by_cell.get(cell)
+            cancelled = []
+            if group is not None:
+                if len(group) > 1:
+                    if cell.citytile is None:
+                        cancelled.extend(group)
+                elif cell.citytile is None and len(cell.units) == 1:
+                    if not any(uid in moving for uid in cell.units):
+                        cancelled.append(group[0])
+            for move in cancelled:
+                cancel(move)
+            for move in cancelled:
+                by_cell.pop(move[4], None)
+        return [move for group in by_cell.values() for move in group]
+
+    # Turn phases
+
+    def citytile_turn(self, citytile):
+        if len(citytile.actions) == 1:
+            name, team, x, y = citytile.actions[0]
+            citytile.cooldown = PARAMS['CITY_ACTION_COOLDOWN']
+            if name == 'r':
+                self.research_points[team] += 1
+                points = self.research_points[team]
+                if points >= PARAMS['RESEARCH_REQUIREMENTS']['COAL']:
+                    self.researched[team]['coal'] = True
+                if points >= PARAMS['RESEARCH_REQUIREMENTS']['URANIUM']:
+                    self.researched[team]['uranium'] = True
+            else:
+                self.spawn_unit(WORKER if name == 'bw' else CART, team, x, y)
+        citytile.actions = []
+        if citytile.cooldown > 0:
+            citytile.cooldown -= 1
+
+    def unit_turn(self, unit):
+        multiplier = 2 if self.is_night() else 1
+        cell = self.cells[unit.y][unit.x]
+        acted = False
+        if len(unit.actions) == 1:
+            action = unit.actions[0]
+            name = action[0]
+            acted = True
+            if name == 'm':
+                self.move_unit(unit, action[3])
+            elif name == 't':
+                self.transfer(*action[1:])
+            elif name == 'bcity' and unit.type == WORKER:
+                self.spawn_city_tile(unit.team, unit.x, unit.y)
+                spent = 0
+                for rtype in RESOURCE_ORDER:
+                    if spent + unit.cargo[rtype] > PARAMS['CITY_BUILD_COST']:
+                        unit.cargo[rtype] -= PARAMS['CITY_BUILD_COST'] - spent
+                        break
+                    spent += unit.cargo[rtype]
+                    unit.cargo[rtype] = 0
+            elif name == 'p' and unit.type == WORKER:
+                cell.road = max(cell.road - PARAMS['PILLAGE_RATE'], PARAMS['MIN_ROAD'])
+            else:
+                acted = False
+        unit.actions = []
+        if acted:
+            unit.cooldown += PARAMS['UNIT_ACTION_COOLDOWN']['WORKER' if unit.type == WORKER else 'CART'] * multiplier
+        if unit.type == CART:
+            cell = self.cells[unit.y][unit.x]
+            if cell.get_road() < PARAMS['MAX_ROAD']:
+                cell.road = min(cell.road + PARAMS['CART_ROAD_DEVELOPMENT_RATE'], PARAMS['MAX_ROAD'])
+
+    def distribute_resources(self, rtype):
+        rate = PARAMS['WORKER_COLLECTION_RATE'][rtype.upper()]
+        fuel_rate = PARAMS['RESOURCE_TO_FUEL_RATE'][rtype.upper()]
+        requests = {}
+        for team in (0, 1):
+            if not self.researched[team][rtype]:
+                continue
+            for unit in self.units[team].values():
+                if unit.type != WORKER:
+                    continue
+                sources = []
+                for dx, dy in DIRECTIONS.values():
+                    x, y = unit.x + dx, unit.y + dy
+                    if self.in_map(x, y):
+                        cell = self.cells[y][x]
+                        if cell.has_resource() and cell.resource_type == rtype:
+                            sources.append(cell)
+                if not sources:
+                    continue
+                amount = min(math.ceil(unit.space_left() / len(sources)), rate)
+                here = self.cells[unit.y][unit.x]
+                city = self.cities[here.citytile.city_id] if here.citytile is not None else None
+                worker = None if city is not None else unit
+                key = (unit.x, unit.y, worker and worker.id, amount, city and city.id)
+                for cell in sources:
+                    cell_requests = requests.setdefault(cell, {})
+                    cell_requests.setdefault(key, [amount, worker, city])
+        for cell, cell_requests in requests.items():
+            available = cell.resource_amount
+            pending = [list(r) for r in cell_requests.values()]
+            while pending and sum(r[0] for r in pending) > 0 and available > 0:
+                amount = min(min(r[0] for r in pending), available // len(pending))
+                for _, worker, city in pending:
+                    if city is not None:
+                        city.fuel += amount * fuel_rate
+                    else:
+                        worker.cargo[rtype] += min(worker.space_left(), amount)
+                for r in pending:
+                    r[0] -= amount
+                available -= amount * len(pending)
+                if available < len(pending):
+                    available = 0
+                pending = [r for r in pending if r[0] > 0]
+            cell.resource_amount = available
+
+    def deposit(self, unit):
+        citytile = self.cells[unit.y][unit.x].citytile
+        if citytile is not None and citytile.team == unit.team:
+            city = self.cities[citytile.city_id]
+            city.fuel += sum(unit.cargo[r] * PARAMS['RESOURCE_TO_FUEL_RATE'][r.upper()] for r in RESOURCE_ORDER)
+            unit.cargo = {'wood': 0, 'coal': 0, 'uranium': 0}
+
+    def handle_night(self):
+        for city in list(self.cities.values()):
+            upkeep = city.get_light_upkeep()
+            if city.fuel < upkeep:
+                self.destroy_city(city.id)
+            else:
+                city.fuel -= upkeep
+        for team in (0, 1):
+            for unit in list(self.units[team].values()):
+                if self.cells[unit.y][unit.x].citytile is None and not unit.spend_fuel_to_survive():
+                    self.destroy_unit(unit)
+
+    def is_match_over(self):
+        if self.turn == PARAMS['MAX_DAYS'] - 1:
+            return True
+        cities = [0, 0]
+        for city in self.cities.values():
+            cities[city.team] += 1
+        return any(len(self.units[team]) + cities[team] == 0 for team in (0, 1))
+
+    def step(self, actions_0: Optional[List[str]], actions_1: Optional[List[str]]) -> List[str]:
+        """Apply both players commands for this turn and return the updates for the next."""
+        placed = {0: set(), 1: set(), 'built': [0, 0]}
+        actions = {'bcity': [], 'bw': [], 'bc': [], 'p': [], 'r': [], 't': [], 'm': []}
+        for team, commands in enumerate((actions_0, actions_1)):
+            for command in commands or []:
+                if command.split(' ')[0][:1] == 'd':
+                    continue
+                try:
+                    action = self.validate_command(team, command, placed)
+                except (InvalidCommand, KeyError, IndexError) as e:
+                    self.warnings.append(f'turn {self.turn}; team {team}; invalid command: {e}')
+                    continue
+                if action is not None:
+                    actions[action[0]].append(action)
+        for name in ('bcity', 'p', 't'):
+            for action in actions[name]:
+                self.units[action[1]][action[2]].actions.append(action)
+        for name in ('bw', 'bc', 'r'):
+            for action in actions[name]:
+                self.cells[action[3]][action[2]].citytile.actions.append(action)
+        for move in self.resolve_moves(actions['m']):
+            if move[3] != 'c':
+                self.units[move[1]][move[2]].actions.append(move)
+
+        for city in list(self.cities.values()):
+            for cell in city.cells:
+                self.citytile_turn(cell.citytile)
+        for team in (0, 1):
+            for unit in list(self.units[team].values()):
+                self.unit_turn(unit)
+        for rtype in DISTRIBUTION_ORDER:
+            self.distribute_resources(rtype)
+        for team in (0, 1):
+            for unit in self.units[team].values():
+                self.deposit(unit)
+        if self.is_night():
+            self.handle_night()
+        self.resources = [c for c in self.resources if c.resource_amount > 0]
+        for cell in self.resources:
+            if cell.resource_type == 'wood' and cell.resource_amount < PARAMS['MAX_WOOD_AMOUNT']:
+                cell.resource_amount = math.ceil(min(cell.resource_amount * PARAMS['WOOD_GROWTH_RATE'],
+                                                     PARAMS['MAX_WOOD_AMOUNT']))
+        self.done = self.is_match_over()
+        self.turn += 1
+        for team in (0, 1):
+            for unit in self.units[team].values():
+                unit.cooldown = max(unit.cooldown - self.cells[unit.y][unit.x].get_road() - 1, 0)
+        self.updates = self.get_updates()
+        return self.updates
+
+    # Observations
+
+    def get_updates(self) -> List[str]:
+        """The engines per turn game information lines, in its order."""
+        lines = [f'rp {team} {self.research_points[team]}' for team in (0, 1)]
+        lines += [f'r {c.resource_type} {c.x} {c.y} {_fmt(c.resource_amount)}' for c in self.resources]
+        for team in (0, 1):
+            lines += [f'u {u.type} {team} {u.id} {u.x} {u.y} {_fmt(u.cooldown)} {u.cargo["wood"]} {u.cargo["coal"]} '
+                      f'{u.cargo["uranium"]}' for u in self.units[team].values()]
+        lines += [f'c {c.team} {c.id} {_fmt(c.fuel)} {_fmt(c.get_light_upkeep())}' for c in self.cities.values()]
+        lines += [f'ct {c.team} {c.id} {cell.x} {cell.y} {_fmt(cell.citytile.cooldown)}'
+                  for c in self.cities.values() for cell in c.cells]
+        for row in self.cells:
+            lines += [f'ccd {cell.x} {cell.y} {_fmt(cell.get_road())}' for cell in row if cell.get_road() != 0]
+        if self.turn == 0:
+            lines = ['0', f'{self.width} {self.height}'] + lines
+        return lines + ['D_DONE']
+
+    def rewards(self):
+        """Kaggle rewards - citytiles, then units as the tie break."""
+        return [self.citytile_count(team) * 10000 + len(self.units[team]) for team in (0, 1)]
+
+    def observation(self, player: int, remaining_overage_time=60) -> Observation:
+        return Observation({
+            'remainingOverageTime': remaining_overage_time,
+            'step': self.turn,
+            'width': self.width,
+            'height': self.height,
+            'reward': self.rewards()[player],
+            'globalUnitIDCount': self.global_unit_id_count,
+            'globalCityIDCount': self.global_city_id_count,
+            'player': player,
+            'updates': self.updates,
+        })
+
+
+def run_match(agents, seed: int, config: Optional[dict] = None):
+    """Play two `agent(obs, config)` callables against each other, returning the final sim."""
+    config = Observation({**DEFAULT_CONFIG, 'seed': seed, **(config or {})})
+    sim = LuxSim(seed)
+    while not sim.done:
+        actions = [agent(sim.observation(player), config) for player, agent in enumerate(agents)]
+        sim.step(*actions)
+    return sim
+
+
+def validate_replay(match) -> Optional[str]:
+    """Step a kaggle replay's recorded actions through the sim, returning a description of the first divergence."""
+    sim = LuxSim(match['configuration']['seed'])
+    steps = match['steps']
+    for step, state in enumerate(steps):
+        if step > 0:
+            sim.step(state[0]['action'], state[1]['action'])
+        expected = state[0]['observation']['updates']
+        if sim.updates != expected:
+            missing = [u for u in expected if u not in sim.updates]
+            extra = [u for u in sim.updates if u not in expected]
+            return f'step {step}: expected {missing[:5]}, got {extra[:5]}'
+    return None
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        with open(path) as f:
+            result = validate_replay(json.load(f))
+        print(path, result or 'OK')
@@ -0,0 +1,239 @@
+"""
+Tournament runner - plays bot versions against each other over a list of seeds on the local forward model.
+
+Games run across a process pool and are appended to a JSON lines results file as they finish, so an interrupted
+tournament resumes without replaying finished games. Each pool process keeps its bots warm in utils.bot_host workers
+between games. Standings report win rates and Elo with 95% intervals.
+"""
+import itertools
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .base import pathroot
+from .bot_host import BotError, BotTimeout, shared_pool
+from .sim import DEFAULT_CONFIG, LuxSim, Observation
+
+LIVE_BOT = 'luxbot'
+ELO_PRIOR_SD = 400  # Keeps ratings finite for unbeaten or winless bots
+ELO_MEAN = 1500
+OVERAGE_TIME = 60  # Seconds of overage per agent per game, as kaggle_environments grants
+
+Game = Tuple[str, str, int]
+
+
+def discover_bots(root: Path = pathroot) -> Dict[str, Path]:
+    """The live bot plus every version persisted under bots/ by create-bot.py."""
+    bots = {LIVE_BOT: root / LIVE_BOT}
+    if (root / 'bots').is_dir():
+        for path in sorted((root / 'bots').iterdir()):
+            if (path / 'agent.py').exists():
+                bots[path.name] = path
+    return bots
+
+
+def schedule(names: Sequence[str], seeds: Sequence[int], gauntlet: Optional[str] = None) -> List[Game]:
+    """Round robin over all pairs, or `gauntlet` against every other bot. Sides alternate with seed parity."""
+    if gauntlet is not None:
+        pairs = [(gauntlet, other) for other in names if other != gauntlet]
+    else:
+        pairs = list(itertools.combinations(names, 2))
+    return [(a, b, seed) if seed % 2 == 0 else (b, a, seed) for seed in seeds for a, b in pairs]
+
+
+def play_match(paths: Dict[str, str], names: Tuple[str, str], seed: int, config: Optional[dict] = None) -> dict:
+    """
+    Play one game between warm hosted bots, returning its result record. As on Kaggle, a bot raising forfeits, and
+    so does a bot over actTimeout once its overage time is used up.
+    """
+    config = Observation({**DEFAULT_CONFIG, 'seed': seed, **(config or {})})
+    pool = shared_pool(paths)
+    agents = []
+    sim = LuxSim(seed)
+    turn_ms = [[], []]
+    errors = [None, None]
+    overage = [OVERAGE_TIME, OVERAGE_TIME]
+    try:
+        for player, name in enumerate(names):
+            try:
+                agents.append(pool.checkout(name))
+            except BotError as e:  # Failed to import or start
+                errors[player] = f'{type(e).__name__}: {e}'
+        while not sim.done and not any(errors):
+            actions = []
+            for player, agent in enumerate(agents):
+                t0 = time.perf_counter()
+                try:
+                    actions.append(agent(sim.observation(player, overage[player]), config))
+                except Exception as e:
+                    errors[player] = f'{type(e).__name__}: {e}'
+                    actions.append([])
+                elapsed = time.perf_counter() - t0
+                turn_ms[player].append(round(elapsed * 1000, 1))
+                if config.get('actTimeout'):
+                    overage[player] -= max(0., elapsed - config['actTimeout'])
+                    if overage[player] < 0 and errors[player] is None:
+                        errors[player] = f'BotTimeout: {names[player]} used up its overage time'
+            sim.step(*actions)
+    finally:
+        for agent in agents:
+            pool.checkin(agent)
+    rewards = sim.rewards()
+    if any(errors):
+        scores = [errors[1] is not None, errors[0] is not None]
+    else:
+        scores = rewards
+    winner = None if scores[0] == scores[1] else names[0 if scores[0] > scores[1] else 1]
+    return {
+        'bots': list(names),
+        'seed': seed,
+        'winner': winner,
+        'citytiles': [r // 10000 for r in rewards],
+        'units': [r % 10000 for r in rewards],
+        'turns': sim.turn,
+        'errors': errors,
+        'turn_ms': turn_ms,
+        'act_timeout': config.get('actTimeout'),
+    }
+
+
+def game_key(result: dict) -> Game:
+    return result['bots'][0], result['bots'][1], result['seed']
+
+
+def load_results(path) -> List[dict]:
+    """Finished games recorded in a results file. A line cut short by an interruption is ignored."""
+    results = []
+    if Path(path).exists():
+        with open(path) as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return results
+
+
+def run_tournament(bots: Dict[str, Path], seeds: Sequence[int], results_path, gauntlet: Optional[str] = None,
+                   workers: Optional[int] = None, config: Optional[dict] = None) -> List[dict]:
+    """Play every scheduled game not already in `results_path`, appending results as games finish."""
+    finished = {game_key(r) for r in load_results(results_path)}
+    games = [g for g in schedule(list(bots), seeds, gauntlet) if g not in finished]
+    paths = {name: str(path) for name, path in bots.items()}
+    print(f'{len(finished)} games already played, {len(games)} to play.')
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(results_path, 'a') as f:
+        futures = {pool.submit(play_match, paths, (a, b), seed, config): (a, b, seed) for a, b, seed in games}
+        for i, future in enumerate(as_completed(futures), 1):
+            a, b, seed = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:  # Not recorded, so a rerun retries the game
+                print(f'[{i}/{len(games)}] seed {seed}: {a} - {b} failed: {type(e).__name__}: {e}', flush=True)
+                continue
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            print(f'[{i}/{len(games)}] seed {seed}: {a} {result["citytiles"][0]} - {result["citytiles"][1]} {b}'
+                  f' -> {result["winner"] or "draw"}', flush=True)
+    return load_results(results_path)
+
+
+def wilson_interval(score: float, n: int, z: float = 1.96) -> Tuple[float, float]:
+    if n == 0:
+        return 0., 1.
+    p = score / n
+    centre = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+    return centre - half, centre + half
+
+
+def score_matrix(results: Sequence[dict], names: Sequence[str]):
+    """Points scored (win 1, draw 0.5) and games played, for each ordered pair of bots."""
+    index = {name: i for i, name in enumerate(names)}
+    points = np.zeros((len(names), len(names)))
+    games = np.zeros((len(names), len(names)))
+    for r in results:
+        a, b = (index[name] for name in r['bots'])
+        games[a, b] += 1
+        games[b, a] += 1
+        if r['winner'] is None:
+            points[a, b] += .5
+            points[b, a] += .5
+        else:
+            points[index[r['winner']], b if index[r['winner']] == a else a] += 1
+    return points, games
+
+
+def fit_elo(points: np.ndarray, games: np.ndarray, iterations: int = 20) -> np.ndarray:
+    """Maximum a posteriori Bradley-Terry ratings on the Elo scale, by Newton's method."""
+    k = math.log(10) / 400
+    ratings = np.zeros(len(points))
+    for _ in range(iterations):
+        p = 1 / (1 + 10 ** ((ratings[None, :] - ratings[:, None]) / 400))
+        gradient = k * (points - games * p).sum(1) - ratings / ELO_PRIOR_SD ** 2
+        weights = k ** 2 * games * p * (1 - p)
+        curvature = np.diag(weights.sum(1) + 1 / ELO_PRIOR_SD ** 2) - weights
+        ratings += np.linalg.solve(curvature, gradient)
+    return ratings - ratings.mean() + ELO_MEAN
+
+
+def standings(results: Sequence[dict], names: Optional[Sequence[str]] = None, samples: int = 200,
+              seed: int = 0) -> List[dict]:
+    """
+    Per bot record, win rate and Elo, each with a 95% interval (Wilson, and bootstrap over games). Timing counts
+    timeout forfeits and turns over the game's actTimeout, the ones that drew on overage time.
+    """
+    names = names or sorted({name for r in results for name in r['bots']})
+    results = [r for r in results if set(r['bots']) <= set(names)]
+    points, games = score_matrix(results, names)
+    elo = fit_elo(points, games)
+    rng = np.random.default_rng(seed)
+    resampled = []
+    for _ in range(samples if results else 0):
+        picks = rng.integers(len(results), size=len(results))
+        resampled.append(fit_elo(*score_matrix([results[i] for i in picks], names)))
+    low, high = np.percentile(resampled, [2.5, 97.5], axis=0) if resampled else (elo, elo)
+    table = []
+    for i, name in enumerate(names):
+        played = [r for r in results if name in r['bots']]
+        turn_ms = [ms for r in played for ms in r['turn_ms'][r['bots'].index(name)]]
+        over_limit = 0
+        for r in played:
+            limit = r.get('act_timeout', DEFAULT_CONFIG['actTimeout'])  # Absent from results of older runs
+            if limit:
+                over_limit += sum(ms > limit * 1000 for ms in r['turn_ms'][r['bots'].index(name)])
+        errors = [r['errors'][r['bots'].index(name)] or '' for r in played]
+        n, score = int(games[i].sum()), points[i].sum()
+        table.append({
+            'bot': name,
+            'games': n,
+            'wins': sum(r['winner'] == name for r in played),
+            'draws': sum(r['winner'] is None for r in played),
+            'win_rate': score / n if n else 0.,
+            'win_rate_ci': wilson_interval(score, n),
+            'elo': elo[i],
+            'elo_ci': (low[i], high[i]),
+            'mean_turn_ms': float(np.mean(turn_ms)) if turn_ms else 0.,
+            'max_turn_ms': float(np.max(turn_ms)) if turn_ms else 0.,
+            'turns_over_limit': over_limit,
+            'timeouts': sum(e.startswith(BotTimeout.__name__) for e in errors),
+            'forfeits': sum(bool(e) for e in errors),
+        })
+    return sorted(table, key=lambda row: -row['elo'])
+
+
+def format_standings(table: Sequence[dict]) -> str:
+    lines = [f'{"bot":<16}{"games":>6}{"wins":>6}{"draws":>6}{"win rate":>22}{"elo":>20}{"ms/turn":>9}{"max ms":>9}'
+             f'{"over":>6}{"t/o":>5}{"forf":>6}']
+    for row in table:
+        win_rate = '{:.1%} [{:.0%}, {:.0%}]'.format(row['win_rate'], *row['win_rate_ci'])
+        elo = '{:.0f} [{:.0f}, {:.0f}]'.format(row['elo'], *row['elo_ci'])
+        lines.append(f'{row["bot"]:<16}{row["games"]:>6}{row["wins"]:>6}{row["draws"]:>6}{win_rate:>22}{elo:>20}'
+                     f'{row["mean_turn_ms"]:>9.1f}{row["max_turn_ms"]:>9.0f}{row["turns_over_limit"]:>6}'
+                     f'{row["timeouts"]:>5}{row["forfeits"]:>6}')
+    lines.append('over: turns over actTimeout, t/o: timeout forfeits, forf: all forfeits')
+    return '\n'.join(lines)